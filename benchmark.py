@@ -0,0 +1,169 @@
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import cache
+import conversation_sizes_histogram
+import conversation_stats
+import ingest
+import largest_chats_all_time
+import largest_chats_over_time
+import output
+import people
+import plots
+import reply_times
+from profiling import peak_rss_mb
+import sources
+import synthetic_inbox
+import time_series
+import utils
+
+ANALYSES = [
+    conversation_sizes_histogram,
+    largest_chats_all_time,
+    largest_chats_over_time,
+    people,
+    conversation_stats,
+    reply_times,
+    time_series,
+]
+
+
+def git_commit():
+    """Returns the commit the code is at, or None outside of a git checkout."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(inbox, plot=True):
+    """Times every stage of every analysis on an inbox. Must be run from a
+    scratch directory, since the analyses write to output/ and cache/.
+
+    Args:
+        inbox (str): the path to the messages/inbox folder.
+        plot (bool, optional): whether to time plot rendering.
+
+    Returns:
+        a list of dicts with the analysis, stage, seconds and peak_rss_mb of
+        each stage, in the order they ran.
+    """
+    stages = []
+
+    def record(analysis, stage, begin, **extra):
+        stages.append(dict(analysis=analysis, stage=stage, seconds=time.perf_counter() - begin,
+                           peak_rss_mb=peak_rss_mb(), **extra))
+
+    source = sources.FolderSource(inbox)
+    begin = time.perf_counter()
+    convs = utils.get_conversations(source)
+    record('ingest', 'discover', begin, conversations=len(convs))
+
+    begin = time.perf_counter()
+    conversations = [ingest.parse_conversation(source, conv) for conv in convs]
+    record('ingest', 'parse', begin, messages=sum(len(c) for c in conversations))
+
+    begin = time.perf_counter()
+    for conversation in conversations:
+        cache.save(source, conversation, source.fingerprint(conversation.name))
+    record('ingest', 'cache_save', begin)
+
+    begin = time.perf_counter()
+    conversations = [cache.load(source, conv, source.fingerprint(conv)) for conv in convs]
+    record('ingest', 'cache_load', begin)
+
+    for analysis in ANALYSES:
+        name = analysis.__name__
+        begin = time.perf_counter()
+        results = [analysis.aggregate(conversation) for conversation in conversations]
+        record(name, 'aggregate', begin)
+
+        begin = time.perf_counter()
+        specs = analysis.run(results)
+        output.writer.flush()
+        record(name, 'write', begin)
+
+        if plot:
+            begin = time.perf_counter()
+            plots.render_all(specs)
+            output.writer.flush()
+            record(name, 'plot', begin, plots=len(specs))
+    output.writer.close()
+    return stages
+
+
+def print_stages(stages, previous=None):
+    """Prints a table of the stages, with the speedup over a previous result
+    file's matching stages if given.
+    """
+    before = {}
+    if previous is not None:
+        before = {(s['analysis'], s['stage']): s['seconds'] for s in previous['stages']}
+    print('\t'.join(['analysis', 'stage', 'seconds', 'peak_rss_mb']
+                    + (['speedup'] if previous is not None else [])))
+    for s in stages:
+        row = [s['analysis'], s['stage'], '{:.3f}'.format(s['seconds']), '{:.1f}'.format(s['peak_rss_mb'])]
+        key = (s['analysis'], s['stage'])
+        if key in before and s['seconds'] > 0:
+            row.append('{:.2f}x'.format(before[key] / s['seconds']))
+        print('\t'.join(row))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times each stage of every analysis on a synthetic (or existing) inbox.')
+    parser.add_argument('--inbox', help='benchmark an existing messages/inbox folder instead')
+    parser.add_argument('--no-plots', action='store_true', help='skip timing plot rendering')
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help='file to write the results to')
+    parser.add_argument('--compare', help='a previous results file to compare against')
+    synthetic_inbox.add_arguments(parser)
+    args = parser.parse_args()
+
+    results_path = os.path.abspath(args.output)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='messenger_stats_benchmark_')
+    try:
+        if args.inbox:
+            inbox = os.path.abspath(args.inbox)
+            config = {'inbox': inbox}
+        else:
+            config = synthetic_inbox.generator_arguments(args)
+            begin = time.perf_counter()
+            inbox = synthetic_inbox.generate(scratch, **config)
+            print('Generated inbox in {:.1f}s'.format(time.perf_counter() - begin))
+        os.chdir(scratch)
+        stages = run_benchmark(inbox, plot=not args.no_plots)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch)
+
+    print_stages(stages, previous)
+    with open(results_path, 'w') as f:
+        json.dump({
+            'commit': git_commit(),
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': config,
+            'stages': stages,
+        }, f, indent=2)
+    print('Results written to ' + results_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import json
+import numpy as np
+import os
+
+import config
+import ingest
+
+CACHE_VERSION = 4  # bump whenever the stored format or parsing changes
+META_FILE = 'meta.json'
+COLUMNS = ['timestamps', 'sender_ids', 'char_counts', 'content_hashes',
+           'react_message', 'react_actor', 'react_emoji']
+
+stats = {'hits': 0, 'misses': 0, 'sampled': 0}  # updated by ingest.load_conversation and approximate_conversation
+
+
+def load(source, conv, key):
+    """Returns the cached copy of a conversation with its columns memory-mapped
+    from disk, or None if there is no up to date copy.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        conv (str): the name of the conversation folder.
+        key (list): the conversation's current fingerprint (see
+            sources.FolderSource.fingerprint).
+
+    Returns:
+        the cached Conversation, or None.
+    """
+    path = os.path.join(config.CACHE_FOLDER, conv)
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if (meta.get('version') != CACHE_VERSION
+            or meta.get('source') != source.location(conv)
+            or meta.get('fingerprint') != key):
+        return None
+
+    conversation = ingest.Conversation(conv)
+    conversation.title = meta['title']
+    conversation.participants = meta['participants']
+    conversation.names = meta['names']
+    conversation.emojis = meta['emojis']
+    for column in COLUMNS:
+        setattr(conversation, column, np.load(os.path.join(path, column + '.npy'), mmap_mode='r'))
+    return conversation
+
+
+def save(source, conversation, key):
+    """Stores a conversation in the cache, replacing any existing copy.
+
+    The metadata file is removed first and written last, so an interrupted save
+    never leaves behind an entry that looks valid.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        conversation (ingest.Conversation): the parsed conversation.
+        key (list): the conversation's fingerprint at the time it was parsed.
+    """
+    path = os.path.join(config.CACHE_FOLDER, conversation.name)
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for column in COLUMNS:
+        np.save(os.path.join(path, column + '.npy'), getattr(conversation, column))
+    meta = {
+        'version': CACHE_VERSION,
+        'source': source.location(conversation.name),
+        'fingerprint': key,
+        'title': conversation.title,
+        'participants': conversation.participants,
+        'names': conversation.names,
+        'emojis': conversation.emojis,
+    }
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
@@ -0,0 +1,4 @@
+# TODO: eventually: make constants available as command line arguments
+MESSAGE_FILE = 'message_{}.json'  # the name of the json file
+MIN_MESSAGE_COUNT = 50  # minimum number of messages required to produce analysis
+CACHE_FOLDER = 'cache'  # where parsed conversations, timestamps and the word index are stored
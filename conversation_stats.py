@@ -1,169 +1,168 @@
-import json
-import matplotlib.pyplot as plt
+import numpy as np
 import os
 
-import messenger_stats as main
+import config
+import output
 import utils
 
-def run(messages_folder):
-    for conv in utils.get_conversations(messages_folder):
-        # Parse data
-        person_to_reacts_received = {}  # person -> { react -> count }
-        person_to_reacts_given = {}     # person -> { react -> count }
-        person_to_message_count = {}
-        person_to_char_count = {}
-        total_message_count = 0
-        message_id = 1
-        while True:
-            try:
-                file_name = main.MESSAGE_FILE.format(message_id)
-                with open(os.path.join(messages_folder, conv, file_name)) as f:
-                    data = json.load(f)
-                participants = [p['name'] for p in data['participants']]
-                for person in participants:
-                    if person not in person_to_reacts_received:
-                        person_to_reacts_received[person] = {}
-                        person_to_reacts_given[person] = {}
-                        person_to_message_count[person] = 0
-                        person_to_char_count[person] = 0
-                for msg in data['messages']:
-                    sender = msg['sender_name']
-                    if sender not in participants:
-                        # person has left the conversation
-                        continue
-                    if 'reactions' in msg:
-                        for react in msg['reactions']:
-                            emoji = react['reaction']
-                            person_to_reacts_received[sender][emoji] = \
-                                person_to_reacts_received[sender].get(emoji, 0) + 1
-                            if react['actor'] in participants:
-                                person_to_reacts_given[react['actor']][emoji] = \
-                                    person_to_reacts_given[react['actor']].get(emoji, 0) + 1
-                    person_to_message_count[sender] += 1
-                    if 'content' in msg:
-                        person_to_char_count[sender] += len(msg['content'])
-                total_message_count += len(data['messages'])
-                message_id += 1
-            except FileNotFoundError:
-                break
-
-        if total_message_count < main.MIN_MESSAGE_COUNT:
-            continue
+PER_CONVERSATION = True  # outputs are written per conversation (see messenger_stats.main)
+
+def aggregate(conversation):
+    """Counts the messages, characters and reacts of each participant.
+
+    Every count is computed with a few vector operations over the
+    conversation's columns: names are mapped to participant indices once, and
+    reacts are counted by the name of their emoji (see
+    utils.unicode_to_react), the usual REACTS first and then every other react
+    of the conversation. The counts of a sampled conversation are scaled to
+    estimates (see ingest.Conversation.scaled).
+
+    Args:
+        conversation (ingest.Conversation): the conversation to analyze.
+
+    Returns:
+        a dict of the participants, the reacts and the counts, as arrays with
+        a row per participant (and a column per react), or None if the
+        conversation is too small to analyze.
+    """
+    if conversation.message_count() < config.MIN_MESSAGE_COUNT:
+        return None
+
+    participants = conversation.participants
+    # index into participants of each name, -1 if the person has left the conversation
+    participant_ids = {person: i for i, person in enumerate(participants)}
+    name_to_participant = np.array([participant_ids.get(name, -1) for name in conversation.names],
+                                   dtype=np.int64)
+    n = len(participants)
+    emoji_reacts = [utils.unicode_to_react(emoji) for emoji in conversation.emojis]
+    reacts = utils.REACTS + sorted(set(emoji_reacts) - set(utils.REACTS))
+    n_reacts = len(reacts)
+
+    senders = name_to_participant[conversation.sender_ids]
+    sent = senders >= 0
+    message_count = np.bincount(senders[sent], minlength=n)
+    char_count = np.zeros(n, dtype=np.int64)
+    np.add.at(char_count, senders[sent], conversation.char_counts[sent])
+
+    receivers = senders[conversation.react_message]
+    actors = name_to_participant[conversation.react_actor]
+    react_ids = np.array([reacts.index(react) for react in emoji_reacts],
+                         dtype=np.int64)[conversation.react_emoji]
+    received = receivers >= 0
+    given = received & (actors >= 0)
+    reacts_received = np.bincount(receivers[received] * n_reacts + react_ids[received],
+                                  minlength=n * n_reacts).reshape(n, n_reacts)
+    reacts_given = np.bincount(actors[given] * n_reacts + react_ids[given],
+                               minlength=n * n_reacts).reshape(n, n_reacts)
 
-        utils.prepare_output_directory(os.path.join('output', 'conversation_stats', conv))
-
-        # Additional post-processing: convert unicode emoji into human-readable description
-        for person, reacts_received in person_to_reacts_received.items():
-            new_dict = {}
-            for unicode_emoji in reacts_received:
-                react = utils.unicode_to_react(unicode_emoji)
-                new_dict[react] = new_dict.get(react, 0) + reacts_received[unicode_emoji]
-            reacts_received.clear()
-            reacts_received.update(new_dict)
-        for person, reacts_given in person_to_reacts_given.items():
-            new_dict = {}
-            for unicode_emoji in reacts_given:
-                react = utils.unicode_to_react(unicode_emoji)
-                new_dict[react] = new_dict.get(react, 0) + reacts_given[unicode_emoji]
-            reacts_given.clear()
-            reacts_given.update(new_dict)
+    return {
+        'name': conversation.name,
+        'participants': participants,
+        'reacts': reacts,
+        'reacts_received': conversation.scaled(reacts_received),
+        'reacts_given': conversation.scaled(reacts_given),
+        'message_count': conversation.scaled(message_count),
+        'char_count': conversation.scaled(char_count),
+    }
+
+
+def run(results, write_data=True):
+    """Writes the per-person counts of each conversation and returns the plot
+    specs (see plots.render).
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+        write_data (bool, optional): whether to write the data files.
+    """
+    specs = []
+    for result in results:
+        if result is None:
+            continue
+        conv = result['name']
+        participants = result['participants']
+        reacts = result['reacts']
+        reacts_received = result['reacts_received'].tolist()
+        reacts_given = result['reacts_given'].tolist()
+        message_count = result['message_count'].tolist()
+        char_count = result['char_count'].tolist()
 
         # Create data files
-        with open(os.path.join('output', 'conversation_stats', conv, 'reacts_received.tsv'), 'w') as f:
-            f.write('\t'.join([
-                'person', 'thumbs_up', 'thumbs_down', 'laughing', 'heart_eyes',
-                'angry', 'cry', 'wow', 'message_count', 'char_count',
-            ]) + '\n')
-            for person, reacts_received in person_to_reacts_received.items():
-                f.write('\t'.join([
-                    person,
-                    str(reacts_received.get('Thumbs Up', 0)),
-                    str(reacts_received.get('Thumbs Down', 0)),
-                    str(reacts_received.get('Laughing', 0)),
-                    str(reacts_received.get('Heart Eyes', 0)),
-                    str(reacts_received.get('Angry', 0)),
-                    str(reacts_received.get('Cry', 0)),
-                    str(reacts_received.get('Wow', 0)),
-                    str(person_to_message_count[person]),
-                    str(person_to_char_count[person]),
-                ]) + '\n')
-        with open(os.path.join('output', 'conversation_stats', conv, 'reacts_given.tsv'), 'w') as f:
-            f.write('\t'.join([
-                'person', 'thumbs_up', 'thumbs_down', 'laughing', 'heart_eyes',
-                'angry', 'cry', 'wow', 'message_count', 'char_count',
-            ]) + '\n')
-            for person, reacts_given in person_to_reacts_given.items():
-                f.write('\t'.join([
-                    person,
-                    str(reacts_given.get('Thumbs Up', 0)),
-                    str(reacts_given.get('Thumbs Down', 0)),
-                    str(reacts_given.get('Laughing', 0)),
-                    str(reacts_given.get('Heart Eyes', 0)),
-                    str(reacts_given.get('Angry', 0)),
-                    str(reacts_given.get('Cry', 0)),
-                    str(reacts_given.get('Wow', 0)),
-                    str(person_to_message_count[person]),
-                    str(person_to_char_count[person]),
-                ]) + '\n')
+        if write_data:
+            output.writer.claim(os.path.join('output', 'conversation_stats', conv), output.DATA_SUFFIXES)
+            for file_name, counts in [('reacts_received.tsv', reacts_received),
+                                      ('reacts_given.tsv', reacts_given)]:
+                lines = ['\t'.join(['person'] + [utils.react_column(react) for react in reacts]
+                                   + ['message_count', 'char_count']) + '\n']
+                for i, person in enumerate(participants):
+                    lines.append('\t'.join([person] + [str(count) for count in counts[i]]
+                                           + [str(message_count[i]), str(char_count[i])]) + '\n')
+                output.writer.write(os.path.join('output', 'conversation_stats', conv, file_name),
+                                    ''.join(lines))
 
         # Create plots
-        thumbs_up = []
-        thumbs_down = []
-        laughing = []
-        heart_eyes = []
-        angry = []
-        cry = []
-        wow = []
-        participants = []
-        for person, reacts_received in person_to_reacts_received.items():
-            participants.append(person)
-            thumbs_up.append(reacts_received.get('Thumbs Up', 0))
-            thumbs_down.append(reacts_received.get('Thumbs Down', 0))
-            laughing.append(reacts_received.get('Laughing', 0))
-            heart_eyes.append(reacts_received.get('Heart Eyes', 0))
-            angry.append(reacts_received.get('Angry', 0))
-            cry.append(reacts_received.get('Cry', 0))
-            wow.append(reacts_received.get('Wow', 0))
-        plt.figure(figsize=(14, 6.5))
-        plt.title('Reacts Received')
-        utils.subcategorybar(plt, participants, [thumbs_up, thumbs_down, laughing, heart_eyes, angry, cry, wow])
-        plt.legend(['Thumbs Up', 'Thumbs Down', 'Laughing', 'Heart Eyes', 'Angry', 'Cry', 'Wow'])
-        plt.savefig(os.path.join('output', 'conversation_stats', conv, 'reacts_received.png'), bbox_inches='tight')
-        plt.close()
-
-        thumbs_up = []
-        thumbs_down = []
-        laughing = []
-        heart_eyes = []
-        angry = []
-        cry = []
-        wow = []
-        participants = []
-        for person, reacts_given in person_to_reacts_given.items():
-            participants.append(person)
-            thumbs_up.append(reacts_given.get('Thumbs Up', 0))
-            thumbs_down.append(reacts_given.get('Thumbs Down', 0))
-            laughing.append(reacts_given.get('Laughing', 0))
-            heart_eyes.append(reacts_given.get('Heart Eyes', 0))
-            angry.append(reacts_given.get('Angry', 0))
-            cry.append(reacts_given.get('Cry', 0))
-            wow.append(reacts_given.get('Wow', 0))
-        plt.figure(figsize=(14, 6.5))
-        plt.title('Reacts Given')
-        utils.subcategorybar(plt, participants, [thumbs_up, thumbs_down, laughing, heart_eyes, angry, cry, wow])
-        plt.legend(['Thumbs Up', 'Thumbs Down', 'Laughing', 'Heart Eyes', 'Angry', 'Cry', 'Wow'])
-        plt.savefig(os.path.join('output', 'conversation_stats', conv, 'reacts_given.png'), bbox_inches='tight')
-        plt.close()
-
-        message_counts = list(person_to_message_count.items())
-        char_counts = list(person_to_char_count.items())
-        message_counts.sort(key=lambda x: x[1])
-        char_counts.sort(key=lambda x: x[1])
-        _, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6.5))
-        ax1.pie([m[1] for m in message_counts], labels=[m[0] for m in message_counts], autopct='%1.1f%%')
-        ax1.title.set_text('Message Counts')
-        ax2.pie([c[1] for c in char_counts], labels=[c[0] for c in char_counts], autopct='%1.1f%%')
-        ax2.title.set_text('Character Counts')
-        plt.tight_layout()
-        plt.savefig(os.path.join('output', 'conversation_stats', conv, 'participation_pie_chart.png'), bbox_inches='tight')
-        plt.close()
+        specs.append({
+            'kind': 'subcategorybar',
+            'path': os.path.join('output', 'conversation_stats', conv, 'reacts_received.png'),
+            'x': participants,
+            'y': [list(counts) for counts in zip(*reacts_received)],
+            'title': 'Reacts Received',
+            'legend': reacts,
+        })
+        specs.append({
+            'kind': 'subcategorybar',
+            'path': os.path.join('output', 'conversation_stats', conv, 'reacts_given.png'),
+            'x': participants,
+            'y': [list(counts) for counts in zip(*reacts_given)],
+            'title': 'Reacts Given',
+            'legend': reacts,
+        })
+
+        message_counts = sorted(zip(participants, message_count), key=lambda x: x[1])
+        char_counts = sorted(zip(participants, char_count), key=lambda x: x[1])
+        specs.append({
+            'kind': 'pies',
+            'path': os.path.join('output', 'conversation_stats', conv, 'participation_pie_chart.png'),
+            'pies': [
+                {'values': [m[1] for m in message_counts], 'labels': [m[0] for m in message_counts],
+                 'title': 'Message Counts'},
+                {'values': [c[1] for c in char_counts], 'labels': [c[0] for c in char_counts],
+                 'title': 'Character Counts'},
+            ],
+        })
+    return specs
+
+
+def tables(results):
+    """Returns the per-person counts of every conversation as tables (see
+    export.export_tables): one with a column per usual react and the other
+    reacts added up, and one with a row per person and react they received or
+    gave.
+    """
+    results = [result for result in results if result is not None]
+    table = {
+        'conversation': [result['name'] for result in results for _ in result['participants']],
+        'person': [person for result in results for person in result['participants']],
+        'message_count': np.concatenate([result['message_count'] for result in results]
+                                        + [np.zeros(0, dtype=np.int64)]),
+        'char_count': np.concatenate([result['char_count'] for result in results]
+                                     + [np.zeros(0, dtype=np.int64)]),
+    }
+    n = len(utils.REACTS)
+    for kind in ['received', 'given']:
+        reacts = np.concatenate([result['reacts_' + kind][:, :n] for result in results]
+                                + [np.zeros((0, n), dtype=np.int64)])
+        for i, react in enumerate(utils.REACTS):
+            table['{}_{}'.format(kind, utils.react_column(react))] = reacts[:, i]
+        table[kind + '_other'] = np.concatenate(
+            [result['reacts_' + kind][:, n:].sum(axis=1) for result in results]
+            + [np.zeros(0, dtype=np.int64)])
+
+    reacts = {'conversation': [], 'person': [], 'react': [], 'received': [], 'given': []}
+    for result in results:
+        people, react_ids = np.nonzero(result['reacts_received'] + result['reacts_given'])
+        reacts['conversation'].extend([result['name']] * len(people))
+        reacts['person'].extend(result['participants'][i] for i in people.tolist())
+        reacts['react'].extend(result['reacts'][i] for i in react_ids.tolist())
+        reacts['received'].extend(result['reacts_received'][people, react_ids].tolist())
+        reacts['given'].extend(result['reacts_given'][people, react_ids].tolist())
+    return {'conversation_stats': table, 'conversation_stats_reacts': reacts}
@@ -0,0 +1,187 @@
+import numpy as np
+import os
+import sqlite3
+
+import ingest
+import output
+
+EXPORT_FOLDER = os.path.join('output', 'export')
+FORMATS = ['tsv', 'parquet', 'sqlite']  # tsv only writes each analysis' own data files
+BATCH_ROWS = 1 << 20  # the number of message rows written at a time
+
+
+class ParquetWriter:
+    """Writes each table to a zstd compressed Parquet file in EXPORT_FOLDER,
+    one row group per batch. Requires pyarrow. The files are written to
+    temporary files, which only replace the previous export once it is closed
+    (see _replace_export).
+    """
+
+    def __init__(self):
+        import pyarrow
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._writers = {}
+        self._paths = []
+        os.makedirs(EXPORT_FOLDER, exist_ok=True)
+
+    def write(self, table, columns):
+        """Appends a batch of rows to a table, creating it if necessary.
+
+        Args:
+            table (str): the name of the table.
+            columns (dict): column name -> list or array of values, all of the
+                same length. Every batch of a table has the same columns.
+        """
+        types = {'int': self._pa.int64(), 'float': self._pa.float64(), 'str': self._pa.string()}
+        batch = self._pa.table({name: self._pa.array(values, type=types[_column_type(values)])
+                                for name, values in columns.items()})
+        writer = self._writers.get(table)
+        if writer is None:
+            path = os.path.join(EXPORT_FOLDER, table + '.parquet')
+            writer = self._pq.ParquetWriter(_temp_path(path), batch.schema, compression='zstd')
+            self._writers[table] = writer
+            self._paths.append(path)
+        writer.write_table(batch)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        _replace_export(self._paths)
+
+
+class SqliteWriter:
+    """Writes every table to a single SQLite database in EXPORT_FOLDER, which
+    only replaces the previous export once it is closed (see ParquetWriter).
+    """
+
+    def __init__(self):
+        os.makedirs(EXPORT_FOLDER, exist_ok=True)
+        self._path = os.path.join(EXPORT_FOLDER, 'export.sqlite')
+        self._db = sqlite3.connect(_temp_path(self._path))
+        self._tables = set()
+
+    def write(self, table, columns):
+        """Appends a batch of rows to a table (see ParquetWriter.write)."""
+        if table not in self._tables:
+            types = {'int': 'INTEGER', 'float': 'REAL', 'str': 'TEXT'}
+            self._db.execute('CREATE TABLE {} ({})'.format(table, ', '.join(
+                '{} {}'.format(name, types[_column_type(values)])
+                for name, values in columns.items())))
+            self._tables.add(table)
+        columns = {name: values.tolist() if isinstance(values, np.ndarray) else list(values)
+                   for name, values in columns.items()}
+        self._db.executemany(
+            'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(columns))),
+            zip(*columns.values()))
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+        _replace_export([self._path])
+
+
+def _temp_path(path):
+    # the file an export file is written to until the export is closed,
+    # without what a crashed export may have left in it
+    temp = path + output.TEMP_SUFFIX
+    if os.path.exists(temp):
+        os.remove(temp)
+    return temp
+
+
+def _replace_export(paths):
+    # moves the files of a finished export into place, then removes every
+    # other file of EXPORT_FOLDER (e.g. of a previous export in another format)
+    for path in paths:
+        os.replace(path + output.TEMP_SUFFIX, path)
+    names = {os.path.basename(path) for path in paths}
+    for entry in os.scandir(EXPORT_FOLDER):
+        if entry.is_file() and entry.name not in names:
+            os.remove(entry.path)
+
+
+def _column_type(values):
+    # 'int', 'float' or 'str', also for empty batches
+    if isinstance(values, np.ndarray):
+        kind = values.dtype.kind
+    else:
+        kind = np.asarray(values[:1]).dtype.kind if len(values) else 'O'
+    if kind in 'iub':
+        return 'int'
+    return 'float' if kind == 'f' else 'str'
+
+
+def open_writer(fmt):
+    """Returns a writer for an export format other than tsv, which replaces
+    any previous export once it is closed. Until then, the previous export is
+    left as it is, even if the run crashes.
+    """
+    return ParquetWriter() if fmt == 'parquet' else SqliteWriter()
+
+
+def export_messages(writer, source, convs):
+    """Writes the messages and reactions of every conversation to the messages
+    and reactions tables, in batches of at least BATCH_ROWS messages.
+
+    Args:
+        writer (ParquetWriter or SqliteWriter): the export to write to.
+        source (sources.FolderSource or sources.ZipSource or
+            sources.MergedSource): the source of the messages.
+        convs (list of str): the names of the conversation folders. Each is
+            loaded from the cache, so this should be called after
+            ingest.aggregate_conversations.
+    """
+    messages = []
+    reactions = []
+    pending = 0
+
+    def flush():
+        for table, batches in [('messages', messages), ('reactions', reactions)]:
+            if batches:
+                writer.write(table, {name: np.concatenate([batch[name] for batch in batches])
+                                     for name in batches[0]})
+                batches.clear()
+
+    for conv in convs:
+        conversation = ingest.load_conversation(source, conv)
+        names = np.array(conversation.names, dtype=object)
+        emojis = np.array(conversation.emojis, dtype=object)
+        messages.append({
+            'conversation': np.full(len(conversation), conv, dtype=object),
+            'message': np.arange(len(conversation)),
+            'timestamp': np.asarray(conversation.timestamps),
+            'sender': names[conversation.sender_ids],
+            'char_count': np.asarray(conversation.char_counts),
+        })
+        reactions.append({
+            'conversation': np.full(len(conversation.react_message), conv, dtype=object),
+            'message': np.asarray(conversation.react_message),
+            'actor': names[conversation.react_actor],
+            'emoji': emojis[conversation.react_emoji],
+        })
+        pending += len(conversation)
+        if pending >= BATCH_ROWS:
+            flush()
+            pending = 0
+    flush()
+
+
+def export_tables(writer, analyses, results, options={}):
+    """Writes the tables of every analysis which has any. An analysis module
+    provides its tables with a tables(results, **options) function, which
+    returns a dict of table name -> columns (see ParquetWriter.write).
+
+    Args:
+        writer (ParquetWriter or SqliteWriter): the export to write to.
+        analyses (list of module): the analyses.
+        results (dict): analysis name -> the aggregate of every conversation.
+        options (dict, optional): analysis name -> the keyword arguments of
+            its tables function (e.g. the resolutions of time_series).
+    """
+    for analysis in analyses:
+        if hasattr(analysis, 'tables'):
+            name = analysis.__name__
+            for table, columns in analysis.tables(results[name], **options.get(name, {})).items():
+                writer.write(table, columns)
@@ -0,0 +1,599 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import importlib
+import json
+import numpy as np
+import random
+import re
+import zlib
+
+import cache
+import config
+import json_stream
+from profiling import profiler
+import sources
+import timestamp_store
+import utils
+
+# the message fields the conversation model is built from
+MESSAGE_FIELDS = ['timestamp_ms', 'sender_name', 'content', 'reactions']
+SAMPLE_BYTES = 1 << 20  # with approx, the bytes read from each conversation larger than this
+WINDOW_BYTES = 1 << 14  # the size of each window a sampled message file is read in
+MESSAGE_SLACK = 1 << 12  # read past the end of a window to parse the messages starting in it
+HEADER_BYTES = 1 << 16  # read from either end of a sampled file for the participants and title
+RESERVOIR_SIZE = 5000  # the most messages kept of a sampled conversation
+
+_decoder = json.JSONDecoder()
+# every message object starts with its sender, and nothing else in a message
+# file does (quotes inside strings are escaped)
+_MESSAGE_START = re.compile(rb'\{\s*"sender_name"')
+_PARTICIPANTS = re.compile(rb'"participants":\s*')
+_TITLE = re.compile(rb'"title":\s*("(?:[^"\\]|\\.)*")')
+
+
+class Conversation:
+    """The parsed contents of a single conversation folder, shared by all of
+    the analyses so that each message file only has to be read once.
+
+    Messages are stored column-wise as NumPy arrays: the i-th entry of
+    timestamps, sender_ids and char_counts all describe the same message, in
+    the order the messages appear in the message files. People and emoji are
+    stored once in the names and emojis tables and referred to by index.
+
+    Attributes:
+        name (str): the conversation folder's name.
+        title (str): the conversation's title, or the folder name if the data
+            does not specify one.
+        participants (list of str): the current participants' names.
+        names (list of str): every name that appears in the conversation.
+        emojis (list of str): every reaction emoji that appears in the
+            conversation.
+        timestamps (int64 array): the time (in ms) each message was sent.
+        sender_ids (int32 array): the index into names of each message's
+            sender.
+        char_counts (int32 array): the number of characters of each
+            message's (repaired, see utils.decode_text) content, 0 if the
+            message has no text content.
+        content_hashes (uint32 array): a hash of each message's content (see
+            content_hash), which tells apart messages sent at the same time.
+        react_message (int32 array): the index of the message each reaction
+            was given to.
+        react_actor (int32 array): the index into names of each reaction's
+            actor.
+        react_emoji (int32 array): the index into emojis of each reaction.
+        scale (float): the number of messages each stored message stands for,
+            which is 1 unless the conversation is a sample (see
+            sample_conversation).
+        count_error (float): the 95% error bound of the estimated number of
+            messages, 0 unless the conversation is a sample.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.title = name
+        self.participants = []
+        self.names = []
+        self.emojis = []
+        self.timestamps = np.zeros(0, dtype=np.int64)
+        self.sender_ids = np.zeros(0, dtype=np.int32)
+        self.char_counts = np.zeros(0, dtype=np.int32)
+        self.content_hashes = np.zeros(0, dtype=np.uint32)
+        self.react_message = np.zeros(0, dtype=np.int32)
+        self.react_actor = np.zeros(0, dtype=np.int32)
+        self.react_emoji = np.zeros(0, dtype=np.int32)
+        self.scale = 1.0
+        self.count_error = 0.0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def message_count(self):
+        """Returns the (estimated) number of messages of the conversation."""
+        return int(self.scaled(len(self)))
+
+    def scaled(self, counts):
+        """Scales counts over the stored messages to (estimates of) counts over
+        the whole conversation, rounded to integers. Counts are returned as is
+        unless the conversation is a sample.
+        """
+        if self.scale == 1:
+            return counts
+        return np.rint(np.asarray(counts) * self.scale).astype(np.int64)
+
+
+class ConversationBuilder:
+    """Collects the values of a conversation's message files (see
+    json_stream.iter_message_file) into the columns of a Conversation.
+
+    The columns are collected in typed arrays (8 or 4 bytes per value rather
+    than a Python int object each), which build() then wraps as NumPy arrays
+    without copying them.
+    """
+
+    def __init__(self, name):
+        self._conversation = Conversation(name)
+        self._name_ids = {}
+        self._emoji_ids = {}
+        self._timestamps = array('q')
+        self._sender_ids = array('i')
+        self._char_counts = array('i')
+        self._content_hashes = array('I')
+        self._react_message = array('i')
+        self._react_actor = array('i')
+        self._react_emoji = array('i')
+
+    def _intern(self, table, ids, value):
+        # each distinct string is only decoded the first time it appears
+        if value not in ids:
+            ids[value] = len(table)
+            table.append(utils.decode(value))
+        return ids[value]
+
+    def add(self, key, value):
+        """Adds a top level value of a message file, or a single message if
+        key is 'messages'. Other keys than messages, title and participants are
+        ignored.
+        """
+        conversation = self._conversation
+        if key == 'messages':
+            for react in value.get('reactions', []):
+                self._react_message.append(len(self._timestamps))
+                self._react_actor.append(self._intern(conversation.names, self._name_ids, react['actor']))
+                self._react_emoji.append(self._intern(conversation.emojis, self._emoji_ids, react['reaction']))
+            self._timestamps.append(value['timestamp_ms'])
+            self._sender_ids.append(self._intern(conversation.names, self._name_ids, value['sender_name']))
+            content = value.get('content', '')
+            # characters are counted in the repaired text (ASCII needs no
+            # repair), but the raw text is hashed so that merge keys are stable
+            self._char_counts.append(len(content if content.isascii() else utils.decode_text(content)))
+            self._content_hashes.append(content_hash(content))
+        elif key == 'title':
+            conversation.title = utils.decode(value)
+        elif key == 'participants':
+            for p in value:
+                name = utils.decode(p['name'])
+                if name not in conversation.participants:
+                    conversation.participants.append(name)
+
+    def build(self):
+        """Returns the Conversation of every value added so far. Nothing can
+        be added after it is built.
+        """
+        conversation = self._conversation
+        conversation.timestamps = np.frombuffer(self._timestamps, dtype=np.int64)
+        conversation.sender_ids = np.frombuffer(self._sender_ids, dtype=np.int32)
+        conversation.char_counts = np.frombuffer(self._char_counts, dtype=np.int32)
+        conversation.content_hashes = np.frombuffer(self._content_hashes, dtype=np.uint32)
+        conversation.react_message = np.frombuffer(self._react_message, dtype=np.int32)
+        conversation.react_actor = np.frombuffer(self._react_actor, dtype=np.int32)
+        conversation.react_emoji = np.frombuffer(self._react_emoji, dtype=np.int32)
+        return conversation
+
+
+def content_hash(content):
+    """Returns a hash of a message's content (as it appears in the message
+    files), which is the same across runs and processes.
+    """
+    return zlib.crc32(content.encode('utf-8'))
+
+
+def parse_conversation(source, conv, stream=False):
+    """Parses all of the message files of a conversation.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource or
+            sources.MergedSource): the source of the messages.
+        conv (str): the name of the conversation folder.
+        stream (bool, optional): whether to parse the files incrementally (see
+            json_stream.iter_message_file).
+
+    Returns:
+        the parsed Conversation.
+    """
+    if isinstance(source, sources.MergedSource):
+        return merge_conversations([parse_conversation(export, conv, stream)
+                                    for export in source.exports(conv)])
+
+    builder = ConversationBuilder(conv)
+    message_id = 1
+    while True:
+        try:
+            f = source.open(conv, config.MESSAGE_FILE.format(message_id))
+        except FileNotFoundError:
+            break
+        with f:
+            for key, value in json_stream.iter_message_file(f, MESSAGE_FIELDS, stream):
+                builder.add(key, value)
+        message_id += 1
+    return builder.build()
+
+
+def sample_conversation(source, conv, sample_bytes=SAMPLE_BYTES):
+    """Estimates a conversation from about sample_bytes of its message files,
+    without parsing the rest of them.
+
+    Each file is split into equal strata, and a window of WINDOW_BYTES at a
+    random offset is read from each stratum, as many as the file's share of
+    sample_bytes. The messages starting in a window are counted and parsed, so
+    the parsed messages are a uniform sample of the conversation, which is
+    reduced to a reservoir of at most RESERVOIR_SIZE messages. The number of
+    messages is estimated from the number of messages per window, treating
+    the windows as a simple random sample. The participants and title are
+    found in the first and last HEADER_BYTES of message_1.json. The offsets
+    are seeded by the conversation's name, so the same files always give the
+    same estimate.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource or
+            sources.MergedSource): the source of the messages. Of a merged
+            conversation, only the largest copy is sampled.
+        conv (str): the name of the conversation folder.
+        sample_bytes (int, optional): the number of bytes to read.
+
+    Returns:
+        the Conversation of the sampled messages, with its scale and
+        count_error set.
+    """
+    if isinstance(source, sources.MergedSource):
+        export = max(source.exports(conv),
+                     key=lambda export: sum(size for _, size, _ in export.fingerprint(conv)))
+        return sample_conversation(export, conv, sample_bytes)
+
+    files = source.fingerprint(conv)
+    total = sum(size for _, size, _ in files)
+    fraction = min(1.0, sample_bytes / total) if total else 1.0
+    rng = random.Random(zlib.crc32(conv.encode('utf-8')))
+    builder = ConversationBuilder(conv)
+    reservoir = []
+    seen = 0
+    estimate = 0.0
+    variance = 0.0
+    for file_name, size, _ in files:
+        num_windows = min(max(1, round(size * fraction / WINDOW_BYTES)), size // WINDOW_BYTES)
+        if num_windows == 0 or num_windows * WINDOW_BYTES >= size:
+            windows = [(0, size, size)]  # too small to sample, the whole file is read
+        else:
+            bounds = np.linspace(0, size, num_windows + 1).astype(np.int64).tolist()
+            windows = [(lo + rng.randrange(hi - lo - WINDOW_BYTES + 1), WINDOW_BYTES, hi - lo)
+                       for lo, hi in zip(bounds[:-1], bounds[1:])]
+        header = file_name == config.MESSAGE_FILE.format(1)
+        counts = []
+        with source.open(conv, file_name) as f:
+            # read front to back, since seeking back in a ZIP member decompresses it again
+            if header:
+                head = f.read(HEADER_BYTES)
+                match = _PARTICIPANTS.search(head)
+                if match is not None:
+                    try:
+                        participants = _decoder.raw_decode(head.decode('latin-1'), match.end())[0]
+                        builder.add('participants', participants)
+                    except ValueError:
+                        pass  # more participants than fit in the header
+            for offset, length, _ in windows:
+                f.seek(offset)
+                data = f.read(length + MESSAGE_SLACK)
+                # message files are ASCII (everything else is \u escaped), so
+                # the offsets of the bytes and of the decoded text agree
+                text = data.decode('latin-1')
+                starts = [match.start() for match in _MESSAGE_START.finditer(data)
+                          if match.start() < length]
+                counts.append(len(starts))
+                for start in starts:
+                    try:
+                        message = _decoder.raw_decode(text, start)[0]
+                    except ValueError:
+                        continue  # runs past the end of what was read
+                    seen += 1
+                    if len(reservoir) < RESERVOIR_SIZE:
+                        reservoir.append(message)
+                    else:
+                        i = rng.randrange(seen)
+                        if i < RESERVOIR_SIZE:
+                            reservoir[i] = message
+            if header:
+                f.seek(max(0, size - HEADER_BYTES))
+                titles = _TITLE.findall(f.read())
+                if titles:
+                    builder.add('title', json.loads(titles[-1].decode('latin-1')))
+
+        estimate += sum(count * stratum / length
+                        for count, (_, length, stratum) in zip(counts, windows))
+        if windows[0][1] < size:
+            spread = np.var(counts, ddof=1) if len(counts) > 1 else np.mean(counts)
+            variance += ((size / WINDOW_BYTES) ** 2 * spread / len(counts)
+                         * (1 - len(counts) * WINDOW_BYTES / size))
+
+    for message in reservoir:
+        builder.add('messages', {field: message[field] for field in MESSAGE_FIELDS if field in message})
+    conversation = builder.build()
+    if len(conversation) > 0:
+        conversation.scale = estimate / len(conversation)
+    conversation.count_error = 1.96 * variance ** 0.5
+    return conversation
+
+
+def merge_conversations(conversations):
+    """Merges the copies of a conversation from several exports. A message is
+    in more than one copy if they have the same timestamp, sender and content
+    hash, and is only kept once. Duplicates are found by sorting on that key,
+    so merging takes O(n log n) time over the columns. The title is taken
+    from the first copy, and the reactions of each message from the copy of
+    it which is kept (the first one), even if a later copy has others.
+
+    Args:
+        conversations (list of Conversation): the copies of the conversation,
+            in order of precedence.
+
+    Returns:
+        the merged Conversation, with its messages from newest to oldest.
+    """
+    merged = Conversation(conversations[0].name)
+    merged.title = conversations[0].title
+    name_ids = {}
+    emoji_ids = {}
+
+    def intern_all(table, ids, values):
+        # the index into the merged table of each value
+        for value in values:
+            if value not in ids:
+                ids[value] = len(table)
+                table.append(value)
+        return np.array([ids[value] for value in values], dtype=np.int32)
+
+    sender_ids = []
+    react_message = []
+    react_actor = []
+    react_emoji = []
+    offset = 0
+    for conversation in conversations:
+        for person in conversation.participants:
+            if person not in merged.participants:
+                merged.participants.append(person)
+        names = intern_all(merged.names, name_ids, conversation.names)
+        emojis = intern_all(merged.emojis, emoji_ids, conversation.emojis)
+        sender_ids.append(names[conversation.sender_ids])
+        react_message.append(np.asarray(conversation.react_message) + offset)
+        react_actor.append(names[conversation.react_actor])
+        react_emoji.append(emojis[conversation.react_emoji])
+        offset += len(conversation)
+    timestamps = np.concatenate([c.timestamps for c in conversations])
+    sender_ids = np.concatenate(sender_ids)
+    content_hashes = np.concatenate([c.content_hashes for c in conversations])
+
+    # lexsort is stable, so the first copy of each message comes first
+    order = np.lexsort((content_hashes, sender_ids, -timestamps))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = ((np.diff(timestamps[order]) != 0) | (np.diff(sender_ids[order]) != 0)
+                 | (np.diff(content_hashes[order].astype(np.int64)) != 0))
+    new_index = np.empty(len(order), dtype=np.int32)
+    new_index[order] = np.cumsum(first) - 1
+    kept = order[first]
+    merged.timestamps = timestamps[kept]
+    merged.sender_ids = sender_ids[kept]
+    merged.char_counts = np.concatenate([c.char_counts for c in conversations])[kept]
+    merged.content_hashes = content_hashes[kept]
+
+    # the reactions of a message are those of the copy that was kept
+    react_message = np.concatenate(react_message)
+    is_kept = np.zeros(len(order), dtype=bool)
+    is_kept[kept] = True
+    reacts = is_kept[react_message]
+    merged.react_message = new_index[react_message[reacts]]
+    merged.react_actor = np.concatenate(react_actor)[reacts]
+    merged.react_emoji = np.concatenate(react_emoji)[reacts]
+    return merged
+
+
+def load_conversation(source, conv, rebuild_cache=False, stream=False):
+    """Returns a conversation, from the cache if its message files have not
+    changed since it was cached and by parsing the message files otherwise.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        conv (str): the name of the conversation folder.
+        rebuild_cache (bool, optional): whether to ignore any cached copy.
+        stream (bool, optional): see parse_conversation.
+
+    Returns:
+        the Conversation.
+    """
+    with profiler.stage('ingest', 'load', conv) as counters:
+        fingerprint = source.fingerprint(conv)
+        conversation = None
+        if not rebuild_cache:
+            conversation = cache.load(source, conv, fingerprint)
+        if conversation is not None:
+            cache.stats['hits'] += 1
+        else:
+            cache.stats['misses'] += 1
+            conversation = parse_conversation(source, conv, stream)
+            cache.save(source, conversation, fingerprint)
+            counters['bytes_read'] = sum(size for _, size, _ in fingerprint)
+        counters['messages'] = len(conversation)
+    return conversation
+
+
+def approximate_conversation(source, conv, rebuild_cache=False, stream=False):
+    """Returns a conversation as cheaply as possible: from the cache if it is
+    up to date, by parsing it if it is at most SAMPLE_BYTES, and as a sample
+    (see sample_conversation) otherwise. Samples are not cached.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource or
+            sources.MergedSource): the source of the messages.
+        conv (str): the name of the conversation folder.
+        rebuild_cache (bool, optional): whether to ignore any cached copy.
+        stream (bool, optional): see parse_conversation.
+
+    Returns:
+        the Conversation.
+    """
+    fingerprint = source.fingerprint(conv)
+    if sum(size for _, size, _ in fingerprint) <= SAMPLE_BYTES:
+        return load_conversation(source, conv, rebuild_cache, stream)
+    conversation = None if rebuild_cache else cache.load(source, conv, fingerprint)
+    if conversation is not None:
+        cache.stats['hits'] += 1
+        return conversation
+    with profiler.stage('ingest', 'sample', conv) as counters:
+        conversation = sample_conversation(source, conv)
+        cache.stats['sampled'] += 1
+        counters['messages'] = len(conversation)
+    return conversation
+
+
+def load_conversations(source, filters=[], rebuild_cache=False, stream=False):
+    """Loads every conversation in the messages folder.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        filters (list of str, optional): see utils.get_conversations.
+        rebuild_cache (bool, optional): see load_conversation.
+        stream (bool, optional): see parse_conversation.
+
+    Returns:
+        a list of the Conversations.
+    """
+    return [load_conversation(source, conv, rebuild_cache, stream)
+            for conv in utils.get_conversations(source, filters)]
+
+
+def _aggregate_conversation(source, conv, analyses, rebuild_cache, stream, approx):
+    """Loads (or approximates) a conversation and reduces it to each analysis'
+    aggregate.
+
+    The analyses with SPILL_TIMESTAMPS set all keep the same sorted timestamps
+    of the conversation, which are taken out of their aggregates, so that
+    only a single copy of them is returned (and sent back by a worker). Those
+    of a sampled conversation are small and stay in the aggregates.
+
+    Returns:
+        a tuple of a dict of analysis name to aggregate, and the sorted
+        timestamps of the conversation if any analysis spills them, or None.
+    """
+    load = approximate_conversation if approx else load_conversation
+    conversation = load(source, conv, rebuild_cache, stream)
+    aggregates = {}
+    spilled = []
+    for name in analyses:
+        analysis = importlib.import_module(name)
+        with profiler.stage(name, 'aggregate', conv) as counters:
+            aggregates[name] = analysis.aggregate(conversation)
+            counters['messages'] = len(conversation)
+        if getattr(analysis, 'SPILL_TIMESTAMPS', False):
+            spilled.append(name)
+    if not spilled or conversation.scale != 1:
+        return aggregates, None
+    timestamps = None
+    for name in spilled:
+        if aggregates[name] is not None:
+            timestamps = aggregates[name].pop('timestamps')
+    if timestamps is None:
+        timestamps = np.sort(conversation.timestamps)
+    return aggregates, timestamps
+
+
+def _aggregate_in_worker(profile, *args):
+    """Runs _aggregate_conversation in a worker process. Only the compact
+    aggregates are sent back to the parent, along with the cache stats and
+    profiler records the worker updated in its own copy of those modules.
+
+    Args:
+        profile (tuple): the parent profiler's enabled and cprofile_analysis.
+        *args: see _aggregate_conversation.
+
+    Returns:
+        a tuple of the change in cache.stats, the profiler records and the
+        aggregates and timestamps.
+    """
+    profiler.enabled, profiler.cprofile_analysis = profile
+    # a forked worker starts with a copy of the parent's records, which the
+    # parent already has
+    profiler.records = []
+    before = dict(cache.stats)
+    outcome = _aggregate_conversation(*args)
+    stats = {key: cache.stats[key] - before[key] for key in before}
+    return stats, profiler.take_records(), outcome
+
+
+def aggregate_conversations(source, analyses, filters=[], rebuild_cache=False,
+                            stream=False, jobs=1, previous={}, approx=False):
+    """Loads every conversation in the messages folder and computes each
+    analysis' per-conversation aggregate, fanning the conversations out to a
+    pool of worker processes if jobs > 1.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        analyses (list of module): the analysis modules, each of which provides
+            an aggregate(conversation) function.
+        filters (list of str, optional): see utils.get_conversations.
+        rebuild_cache (bool, optional): see load_conversation.
+        stream (bool, optional): see parse_conversation.
+        jobs (int, optional): the number of worker processes to use.
+        previous (dict, optional): the conversations of a previous run (see
+            manifest.load). Conversations whose message files have not changed
+            since are not loaded again, and their stored aggregates are reused.
+        approx (bool, optional): whether to sample large conversations instead
+            of parsing them (see approximate_conversation).
+
+    The timestamps of the analyses with SPILL_TIMESTAMPS set are moved from
+    their aggregates to timestamp_store.store.
+
+    Returns:
+        an ordered dict of conversation name -> {
+            'fingerprint': see sources.FolderSource.fingerprint,
+            'aggregates': { analysis name -> aggregate },
+            'changed': whether the aggregates were (re)computed,
+        }.
+    """
+    names = [analysis.__name__ for analysis in analyses]
+    # the analyses whose timestamps are moved to the timestamp store
+    spilled = [analysis.__name__ for analysis in analyses if getattr(analysis, 'SPILL_TIMESTAMPS', False)]
+    store = timestamp_store.store
+    conversations = {}
+    args = []
+    with profiler.stage('ingest', 'discover'):
+        for conv in utils.get_conversations(source, filters):
+            fingerprint = source.fingerprint(conv)
+            entry = previous.get(conv)
+            if (entry is not None and entry['fingerprint'] == fingerprint
+                    and all(name in entry['aggregates'] for name in names)
+                    and (not spilled or store.has(conv, [source.location(conv), fingerprint]))):
+                aggregates = {name: entry['aggregates'][name] for name in names}
+                conversations[conv] = {'fingerprint': fingerprint, 'aggregates': aggregates, 'changed': False}
+            else:
+                conversations[conv] = {'fingerprint': fingerprint, 'aggregates': None, 'changed': True}
+                args.append((source, conv, names, rebuild_cache, stream, approx))
+
+    def collect(conv, outcome):
+        # Each conversation's timestamps are appended to the store as soon as
+        # they arrive, so they are never all in memory at once. Samples (see
+        # approx) are small and never stored.
+        aggregates, timestamps = outcome
+        key = [source.location(conv), conversations[conv]['fingerprint']]
+        if timestamps is not None and not store.has(conv, key):
+            store.append(conv, key, timestamps)
+        conversations[conv]['aggregates'] = aggregates
+
+    if jobs > 1 and len(args) > 1:
+        profile = (profiler.enabled, profiler.cprofile_analysis)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(args) // (jobs * 4))
+            outcomes = executor.map(_aggregate_in_worker, [profile] * len(args), *zip(*args),
+                                    chunksize=chunksize)
+            for a, (stats, records, outcome) in zip(args, outcomes):
+                for key in stats:
+                    cache.stats[key] += stats[key]
+                profiler.records.extend(records)
+                collect(a[1], outcome)
+    else:
+        for a in args:
+            collect(a[1], _aggregate_conversation(*a))
+
+    if spilled:
+        with profiler.stage('ingest', 'store'):
+            store.save(keep=conversations)
+    return conversations
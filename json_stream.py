@@ -0,0 +1,159 @@
+import io
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_SIZE = 1 << 16  # the number of characters read from a file at a time
+
+_decoder = json.JSONDecoder()
+# the ijson events which complete a value
+_END_EVENTS = ('end_map', 'end_array', 'string', 'number', 'boolean', 'null')
+
+
+def iter_message_file(f, fields=None, stream=False):
+    """Iterates over the contents of a message file. The top level values are
+    yielded as (key, value) pairs, except for the messages which are yielded
+    one at a time as ('messages', message) pairs, in the order they appear in
+    the file.
+
+    Args:
+        f (file): the message file, opened in binary mode.
+        fields (list of str, optional): if given, the message fields to keep.
+            Every other field is dropped as soon as the message is parsed.
+        stream (bool, optional): whether to parse the file incrementally, so
+            that only one message is held in memory at a time, instead of
+            loading the whole file at once. Uses ijson if it is installed and
+            a pure Python parser otherwise.
+
+    Yields:
+        the (key, value) pairs of the file.
+    """
+    if not stream:
+        items = _iter_loaded(json.load(f))
+    elif ijson is not None:
+        items = _iter_ijson(f)
+    else:
+        items = _iter_stream(io.TextIOWrapper(f, encoding='utf-8'))
+    for key, value in items:
+        if key == 'messages' and fields is not None:
+            value = {field: value[field] for field in fields if field in value}
+        yield key, value
+
+
+def _iter_loaded(data):
+    for key, value in data.items():
+        if key == 'messages':
+            for message in value:
+                yield key, message
+        else:
+            yield key, value
+
+
+def _iter_ijson(f):
+    key = None  # the top level key currently being parsed
+    builder = None  # builds the current message or top level value
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if prefix == '':
+            if event == 'map_key':
+                key = value
+            continue
+        if key == 'messages':
+            if prefix == 'messages':
+                continue  # the start or end of the array itself
+            if builder is None:
+                builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            if prefix == 'messages.item' and event in _END_EVENTS:
+                yield key, builder.value
+                builder = None
+        else:
+            if builder is None:
+                builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            if prefix == key and event in _END_EVENTS:
+                yield key, builder.value
+                builder = None
+
+
+class _Reader:
+    """A buffered reader which decodes one JSON value at a time from a file,
+    only keeping the unparsed part of the current chunk in memory.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skips whitespace and returns the next character ('' at the end of
+        the file) without consuming it.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, *chars):
+        """Consumes and returns the next character, which must be in chars."""
+        c = self.peek()
+        if c not in chars or c == '':
+            raise ValueError('malformed message file: expected {} at {!r}'.format(
+                ' or '.join(chars), self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Consumes and returns the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # a value that is not followed by a delimiter (e.g. the number
+                # 1 in 1.5) may continue in the next chunk
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in ',:]} \t\n\r'):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def _iter_stream(f):
+    reader = _Reader(f)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'messages' and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(',', ']') == ']':
+                        break
+        else:
+            yield key, reader.value()
+        if reader.expect(',', '}') == '}':
+            return
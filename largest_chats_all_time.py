@@ -1,45 +1,54 @@
-import json
-import matplotlib.pyplot as plt
 import os
 
-import messenger_stats as main
-import utils
+import output
 
 N = 10  # the number of top conversations to record
 
-def run(messages_folder):
-    utils.prepare_output_directory(os.path.join('output', 'largest_chats_all_time'))
-
-    # Parse data
-    conversations = []
-    for conv in utils.get_conversations(messages_folder):
-        message_id = 1
-        conversation = {'title': conv, 'count': 0}
-        while True:
-            try:
-                file_name = main.MESSAGE_FILE.format(message_id)
-                with open(os.path.join(messages_folder, conv, file_name)) as f:
-                    data = json.load(f)
-                conversation['count'] += len(data['messages'])
-                if 'title' in data:
-                    conversation['title'] = data['title']
-                message_id += 1
-            except FileNotFoundError:
-                break
-        conversations.append(conversation)
-    conversations.sort(key=lambda x: x['count'], reverse=True)
+def aggregate(conversation):
+    """Returns the title and (estimated) number of messages of a conversation,
+    and the error bound of the estimate (0 if it is exact).
+    """
+    return {'title': conversation.title, 'count': conversation.message_count(),
+            'error': round(conversation.count_error)}
+
+
+def run(conversations, write_data=True):
+    """Writes the conversations ranked by size and returns the plot specs (see
+    plots.render).
+
+    Args:
+        conversations (list of dict): the aggregate of every conversation.
+        write_data (bool, optional): whether to write the data files.
+    """
+    conversations = sorted(conversations, key=lambda x: x['count'], reverse=True)
+    # the 95% error bounds are only written if any count is estimated
+    approximate = any(c['error'] for c in conversations)
 
     # Create data file
-    with open(os.path.join('output', 'largest_chats_all_time', 'data.tsv'), 'w') as f:
-        f.write('\t'.join(['title', 'count']) + '\n')
+    if write_data:
+        lines = ['\t'.join(['title', 'count'] + (['error'] if approximate else [])) + '\n']
         for c in conversations:
-            f.write('\t'.join([c['title'], str(c['count'])]) + '\n')
-    
+            lines.append('\t'.join([c['title'], str(c['count'])]
+                                   + ([str(c['error'])] if approximate else [])) + '\n')
+        output.writer.claim(os.path.join('output', 'largest_chats_all_time'), output.DATA_SUFFIXES)
+        output.writer.write(os.path.join('output', 'largest_chats_all_time', 'data.tsv'), ''.join(lines))
+
     # Create plot
-    x = [c['title'] for c in conversations[:N]]
-    y = [c['count'] for c in conversations[:N]]
-    plt.figure(figsize=(14, 6.5))
-    plt.bar(x, y)
-    plt.title('Top Conversations by Message Count')
-    plt.savefig(os.path.join('output', 'largest_chats_all_time', 'plot.png'), bbox_inches='tight')
-    plt.close()
+    return [{
+        'kind': 'bar',
+        'path': os.path.join('output', 'largest_chats_all_time', 'plot.png'),
+        'x': [c['title'] for c in conversations[:N]],
+        'y': [c['count'] for c in conversations[:N]],
+        'title': 'Top Conversations by Message Count',
+    }]
+
+
+def tables(conversations, n=None):
+    """Returns the conversations ranked by size as a table (see
+    export.export_tables), optionally only the n largest.
+    """
+    conversations = sorted(conversations, key=lambda x: x['count'], reverse=True)[:n]
+    return {'largest_chats_all_time': {
+        'title': [c['title'] for c in conversations],
+        'count': [c['count'] for c in conversations],
+    }}
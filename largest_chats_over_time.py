@@ -1,91 +1,185 @@
 from datetime import datetime
-import bisect
-import json
-import matplotlib.pyplot as plt
+import math
+import numpy as np
 import os
 
-import messenger_stats as main
+import output
+import timestamp_store
 import utils
 
 N = 5  # the number of top conversations to record per time interval
 TIME_INTERVAL = 30  # the number of days per time interval to analyze
+SPILL_TIMESTAMPS = True  # the timestamps are moved to the timestamp store (see ingest.aggregate_conversations)
+
+def aggregate(conversation):
+    """Returns the sorted message timestamps of a conversation (and the
+    number of messages each stands for and the error bound of its estimated
+    size, see ingest.Conversation.scale), or None if the conversation has no
+    messages. The timestamps are usually moved
+    to the timestamp store before the aggregate is used (see
+    timestamp_store.aggregate_chunks).
+
+    Args:
+        conversation (ingest.Conversation): the conversation to analyze.
+    """
+    if len(conversation) == 0:
+        return None
+    return {
+        'name': conversation.name,
+        'title': conversation.title,
+        'timestamps': np.sort(conversation.timestamps),
+        'scale': conversation.scale,
+        'count_error': conversation.count_error,
+    }
+
+
+def _interval_starts(results, time_interval):
+    # the start (in ms) of every interval from the first message to the last
+    bounds = [bounds for bounds in map(timestamp_store.aggregate_span, results) if bounds[0] > 0]
+    if not bounds:
+        return np.zeros(0, dtype=np.int64)
+    first = min(first for _, first, _ in bounds)
+    last = max(last for _, _, last in bounds)
+    return np.arange(first, last, time_interval * utils.MILLISECONDS_PER_DAY, dtype=np.int64)
+
+
+def _count(result, interval_starts):
+    # the number of messages of a conversation in each interval
+    counts = np.zeros(len(interval_starts), dtype=np.int64)
+    for timestamps in timestamp_store.aggregate_chunks(result):
+        # the last interval is open ended, so every message belongs to one
+        counts += np.bincount(np.searchsorted(interval_starts, timestamps, side='right') - 1,
+                              minlength=len(interval_starts))
+    return counts
+
+
+def _sampling_error(count, result):
+    # the 95% error bound of a conversation's estimated count of an interval,
+    # from the error of its estimated size and of the fraction of its sample
+    # which is in the interval (0 if it is not sampled)
+    if result['scale'] == 1:
+        return 0
+    sampled = timestamp_store.aggregate_span(result)[0]
+    size = sampled * result['scale']
+    fraction = count / size
+    return round(math.sqrt((fraction * result['count_error']) ** 2
+                           + 1.96 ** 2 * size ** 2 * fraction * (1 - fraction) / sampled))
+
+
+def rank(results, time_interval=TIME_INTERVAL, n=N):
+    """Counts the messages of every conversation in each time interval, and
+    ranks the conversations of each interval by their counts.
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+        time_interval (int, optional): the number of days per time interval.
+        n (int, optional): the number of top conversations per interval.
+
+    Returns:
+        a tuple of the conversations' titles, the start of each interval (in
+        ms), the (interval x conversation) matrix of counts, the total count of
+        each interval and the indices of each interval's top n conversations.
+        The counts of sampled conversations are estimates (see
+        ingest.Conversation.scaled).
+    """
+    results = [result for result in results if result is not None]
+    titles = [result['title'] for result in results]
+    num_conversations = len(results)
+
+    # Bin the messages of each conversation, a chunk of timestamps at a time,
+    # into a dense (interval x conversation) matrix of counts, so only the
+    # counts (and not every timestamp) are ever held in memory.
+    interval_starts = _interval_starts(results, time_interval)
+    num_intervals = len(interval_starts)
+    counts = np.zeros((num_conversations, num_intervals), dtype=np.int64)
+    if num_intervals > 0:
+        for conv, result in enumerate(results):
+            counts[conv] = np.rint(_count(result, interval_starts) * result['scale'])
+    counts = counts.T
+    totals = counts.sum(axis=1)
+
+    # Select the top n conversations of each interval. Ties are broken in favour
+    # of the conversation that appears first, so the ranking is deterministic.
+    top = min(n, num_conversations)
+    keys = counts * num_conversations + (num_conversations - 1 - np.arange(num_conversations))
+    if 0 < top < num_conversations:
+        candidates = np.argpartition(-keys, top - 1, axis=1)[:, :top]
+    else:
+        candidates = np.tile(np.arange(num_conversations), (num_intervals, 1))
+    order = np.argsort(-np.take_along_axis(keys, candidates, axis=1), axis=1, kind='stable')
+    top_conversations = np.take_along_axis(candidates, order, axis=1)[:, :top]
+    return titles, interval_starts, counts, totals, top_conversations
+
+
+def run(results, time_interval=TIME_INTERVAL, write_data=True):
+    """Writes the largest conversations of each time interval and returns the
+    plot specs (see plots.render).
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+        time_interval (int, optional): the number of days per time interval.
+        write_data (bool, optional): whether to write the data files.
+    """
+    titles, interval_starts, counts, totals, top_conversations = rank(results, time_interval)
+    results = [result for result in results if result is not None]  # indexed like titles
+    # the estimated counts of sampled conversations are written with their
+    # error bounds
+    approximate = any(result['scale'] != 1 for result in results)
+    top = []
+    for i, row in enumerate(top_conversations.tolist()):
+        interval_counts = counts[i].tolist()
+        top.append([(conv, interval_counts[conv],
+                     _sampling_error(interval_counts[conv], results[conv]) if approximate else None)
+                    for conv in row if interval_counts[conv] > 0])
+    num_intervals = len(interval_starts)
 
-def run(messages_folder, time_interval=TIME_INTERVAL):
-    utils.prepare_output_directory(os.path.join('output', 'largest_chats_over_time'))
-
-    # Parse data
-    conversation_to_timestamps = {}
-    conversation_to_title = {}
-    time_begin = None  # the globally smallest timestamp
-    time_end = None  # the globally largest timestamp
-    for conv in utils.get_conversations(messages_folder):
-        message_id = 1
-        timestamps = []
-        while True:
-            try:
-                file_name = main.MESSAGE_FILE.format(message_id)
-                with open(os.path.join(messages_folder, conv, file_name)) as f:
-                    data = json.load(f)
-                timestamps.extend([message['timestamp_ms'] for message in data['messages']])
-                conversation_to_title[conv] = data['title'] if 'title' in data else conv
-                message_id += 1
-            except FileNotFoundError:
-                break
-        timestamps.sort()
-        time_begin = timestamps[0] if time_begin == None else min(time_begin, timestamps[0])
-        time_end = timestamps[-1] if time_end == None else max(time_end, timestamps[-1])
-        conversation_to_timestamps[conv] = timestamps
-    
-    conversations_over_time = {}  # interval start -> { conversation -> message count }
-    interval_starts = range(time_begin, time_end, time_interval * utils.MILLISECONDS_PER_DAY)
-    for center in interval_starts:
-        conversations_over_time[center] = {}
-
-    total_title = '__total__'
-    for conv, times in conversation_to_timestamps.items():
-        for i in range(len(interval_starts)):
-            lower = interval_starts[i]
-            upper = utils.ENDTIME if i + 1 == len(interval_starts) else interval_starts[i + 1]
-            ind_l = bisect.bisect_left(times, lower)
-            ind_r = bisect.bisect_left(times, upper)
-            num_messages = ind_r - ind_l
-            if num_messages != 0:
-                conversations_over_time[interval_starts[i]][conv] = num_messages
-
-            if (total_title not in conversations_over_time[interval_starts[i]]):
-                conversations_over_time[interval_starts[i]][total_title] = 0
-            conversations_over_time[interval_starts[i]][total_title] += num_messages
-    
     # Create data file
-    conversation_to_title['__total__'] = 'Total'
+    interval_starts = interval_starts.tolist()
     interval_starts_str = []
-    total_messages = []
-    with open(os.path.join('output', 'largest_chats_over_time', 'data.tsv'), 'w') as f:
-        for i in range(len(interval_starts)):
-            lower_str = str(datetime.utcfromtimestamp(interval_starts[i] / 1000))
-            upper_str = str(datetime.utcfromtimestamp(interval_starts[i + 1] / 1000)) if i + 1 < len(interval_starts) else 'End'
-            f.write('\t'.join(['timestamp', str(interval_starts[i])]) + '\n')
-            f.write('\t'.join(['lower', lower_str]) + '\n')
-            f.write('\t'.join(['upper', upper_str]) + '\n')
-            conversations_over_time[interval_starts[i]] = sorted(
-                conversations_over_time[interval_starts[i]].items(), key=lambda x: x[1], reverse=True)
-
-            frequented = conversations_over_time[interval_starts[i]][:N + 1]  # +1 is for total
-            for conv, count in frequented:
-                f.write('\t'.join([conversation_to_title[conv], str(count)]) + '\n')
-            f.write('\n')
-
-            interval_starts_str.append(lower_str)
-            total_messages.append(frequented[0][1])
+    total_messages = totals.tolist()
+    lines = []
+    for i in range(num_intervals):
+        lower_str = str(datetime.utcfromtimestamp(interval_starts[i] / 1000))
+        upper_str = str(datetime.utcfromtimestamp(interval_starts[i + 1] / 1000)) if i + 1 < num_intervals else 'End'
+        lines.append('\t'.join(['timestamp', str(interval_starts[i])]) + '\n')
+        lines.append('\t'.join(['lower', lower_str]) + '\n')
+        lines.append('\t'.join(['upper', upper_str]) + '\n')
+        lines.append('\t'.join(['Total', str(total_messages[i])]) + '\n')
+        for conv, count, error in top[i]:
+            lines.append('\t'.join([titles[conv], str(count)]
+                                   + ([] if error is None else [str(error)])) + '\n')
+        lines.append('\n')
+
+        interval_starts_str.append(lower_str)
+    if write_data:
+        output.writer.claim(os.path.join('output', 'largest_chats_over_time'), output.DATA_SUFFIXES)
+        output.writer.write(os.path.join('output', 'largest_chats_over_time', 'data.tsv'), ''.join(lines))
 
     # Create plot
     # TODO: make this more interesting: plot more than just total somehow?
     # TODO: don't plot all the dates lol
-    plt.figure(figsize=(14, 6.5))
-    plt.plot(interval_starts_str, total_messages)
-    plt.title('Total Messages over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Messages per Interval')
-    plt.savefig(os.path.join('output', 'largest_chats_over_time', 'total_message_time_series.png'),
-                bbox_inches='tight')
-    plt.close()
+    return [{
+        'kind': 'line',
+        'path': os.path.join('output', 'largest_chats_over_time', 'total_message_time_series.png'),
+        'x': interval_starts_str,
+        'y': total_messages,
+        'title': 'Total Messages over Time',
+        'xlabel': 'Date',
+        'ylabel': 'Messages per Interval',
+    }]
+
+
+def tables(results, time_interval=TIME_INTERVAL, n=N):
+    """Returns the largest conversations of each time interval as a table (see
+    export.export_tables and rank).
+    """
+    titles, interval_starts, counts, totals, top_conversations = rank(results, time_interval, n)
+    interval, position = np.nonzero(np.take_along_axis(counts, top_conversations, axis=1))
+    conversations = top_conversations[interval, position]
+    return {'largest_chats_over_time': {
+        'interval_start': interval_starts[interval],
+        'interval_total': totals[interval],
+        'rank': position + 1,
+        'title': [titles[conv] for conv in conversations.tolist()],
+        'count': counts[interval, conversations],
+    }}
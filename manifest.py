@@ -0,0 +1,52 @@
+import os
+import pickle
+
+MANIFEST_FILE = os.path.join('output', 'manifest.pickle')
+MANIFEST_VERSION = 9  # bump whenever the aggregates of any analysis change
+
+
+def load(source):
+    """Returns the conversations recorded by the previous run on the same
+    messages folder.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+
+    Returns:
+        a dict of conversation name -> { 'fingerprint', 'aggregates' } (see
+        ingest.aggregate_conversations), which is empty if there is no usable
+        manifest.
+    """
+    try:
+        with open(MANIFEST_FILE, 'rb') as f:
+            manifest = pickle.load(f)
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+        return {}
+    if (manifest.get('version') != MANIFEST_VERSION
+            or manifest.get('source') != source.name):
+        return {}
+    return manifest['conversations']
+
+
+def save(source, conversations):
+    """Records the fingerprints and aggregates of every conversation, so the
+    next incremental run can skip the ones that do not change.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        conversations (dict): see ingest.aggregate_conversations.
+    """
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'source': source.name,
+        'conversations': {
+            conv: {'fingerprint': entry['fingerprint'], 'aggregates': entry['aggregates']}
+            for conv, entry in conversations.items()
+        },
+    }
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    with open(MANIFEST_FILE + '.tmp', 'wb') as f:
+        pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(MANIFEST_FILE + '.tmp', MANIFEST_FILE)
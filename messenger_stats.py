@@ -1,52 +1,227 @@
 import argparse
-import matplotlib.pyplot as plt
+import importlib
+import importlib.util
+import inspect
 import os
 
-import conversation_sizes_histogram
-import conversation_stats
-import largest_chats_all_time
-import largest_chats_over_time
-import time_series
-import utils
+# The available analyses, in the order they are run. Each is only imported
+# (along with numpy and the rest of the pipeline) if it is selected.
+# Note the individual analyses (conversation_stats, reply_times, time_series)
+# tend to take much longer if the number of conversations to analyze is not
+# restricted.
+ANALYSES = {
+    # Aggregate analyses
+    'conversation_sizes_histogram': 'histogram of the number of messages per conversation',
+    'largest_chats_all_time': 'conversations ranked by number of messages',
+    'largest_chats_over_time': 'the largest conversations of every 30 day interval',
+    'people': 'every person across all conversations, and who talks and reacts to whom',
 
-# TODO: eventually: make constants available as command line arguments
-MESSAGE_FILE = 'message_{}.json'  # the name of the json file
-MIN_MESSAGE_COUNT = 50  # minimum number of messages required to produce analysis
+    # Individual analyses
+    'conversation_stats': 'messages, characters and reacts of each person',
+    'reply_times': 'reply times, turns and sessions of each person',
+    'time_series': 'messages over time',
+}
 
 def main():
     args = parse_arguments()
-    print_warning_message()
+    if not args.plots_only and not args.incremental:
+        print_warning_message()
 
-    # Analyses to perform: comment individual lines to skip that analysis.
+    # Imported here so that listing the analyses or printing the help never
+    # pays for numpy (and plotting never happens unless asked for)
+    import cache
+    import export
+    import ingest
+    import manifest
+    import output
+    import plots
+    from profiling import profiler
+    import word_index
 
-    # Aggregate analyses
-    conversation_sizes_histogram.run(args.folder)
-    largest_chats_all_time.run(args.folder)
-    largest_chats_over_time.run(args.folder)
+    if args.profile:
+        profiler.enable(cprofile_analysis=args.profile_analysis)
+    analyses = [importlib.import_module(name) for name in args.only]
+
+    # Every message file is parsed at most once, and each conversation is
+    # reduced to the compact aggregates the analyses need before the next one
+    # is loaded. Incremental runs reuse the aggregates of the conversations
+    # that have not changed since the previous run.
+    previous = manifest.load(args.source) if args.incremental else {}
+    conversations = ingest.aggregate_conversations(
+        args.source, analyses, rebuild_cache=args.rebuild_cache, stream=args.stream,
+        jobs=args.jobs, previous=previous, approx=args.approx)
+    print('Cache: {} hits, {} misses'.format(cache.stats['hits'], cache.stats['misses']))
+    if args.approx:
+        print('Approximate: {} conversations sampled'.format(cache.stats['sampled']))
+
+    changed = [conv for conv, entry in conversations.items() if entry['changed']]
+    removed = [conv for conv in previous if conv not in conversations]
+    if args.incremental:
+        print('Incremental: {} changed, {} unchanged, {} removed conversations'.format(
+            len(changed), len(conversations) - len(changed), len(removed)))
+
+    # The kinds of output files this run writes, which are the only ones it
+    # replaces
+    suffixes = ()
+    if not args.plots_only:
+        suffixes += output.DATA_SUFFIXES
+    if not args.no_plots:
+        suffixes += output.PLOT_SUFFIXES
+
+    specs = []
+    for analysis in analyses:
+        name = analysis.__name__
+        entries = list(conversations.values())
+        if args.incremental and getattr(analysis, 'PER_CONVERSATION', False):
+            # only the outputs of changed conversations are recomputed, the
+            # aggregate analyses are always reduced from every conversation
+            for conv in changed:
+                output.writer.claim(os.path.join('output', name, conv), suffixes)
+            for conv in removed:
+                output.writer.claim(os.path.join('output', name, conv))
+            entries = [entry for entry in entries if entry['changed']]
+        results = [entry['aggregates'][name] for entry in entries]
+        with profiler.stage(name, 'write'):
+            specs.extend((name, spec) for spec in analysis.run(
+                results, write_data=not args.plots_only and args.format == 'tsv',
+                **analysis_options(analysis.run, args)))
+
+    # Other formats replace the data files with an export of the messages and
+    # of every analysis' data, so those of a previous run are removed
+    if args.format != 'tsv' and not args.plots_only:
+        for analysis in analyses:
+            output.writer.claim(os.path.join('output', analysis.__name__), output.DATA_SUFFIXES)
+        tables_options = {analysis.__name__: analysis_options(analysis.tables, args)
+                          for analysis in analyses if hasattr(analysis, 'tables')}
+        writer = export.open_writer(args.format)
+        with profiler.stage('export', 'write'):
+            export.export_messages(writer, args.source, list(conversations))
+            export.export_tables(writer, analyses, {
+                analysis.__name__: [entry['aggregates'][analysis.__name__]
+                                    for entry in conversations.values()]
+                for analysis in analyses}, tables_options)
+        writer.close()
 
-    # Individual analyses: note these tend to take much longer if the number of
-    # conversations to analyze is not restricted.
-    conversation_stats.run(args.folder)
-    time_series.run(args.folder)
+    # Plots are drawn after all of the analyses are done, in parallel if
+    # multiple jobs are allowed.
+    if not args.no_plots:
+        timings = plots.render_all([spec for _, spec in specs], jobs=args.jobs)
+        if profiler.enabled:
+            for (name, spec), (seconds, peak_rss) in zip(specs, timings):
+                profiler.add(name, 'plot', seconds, peak_rss=peak_rss)
+
+    # Every file is written in the background (see output.Writer), so wait for
+    # them before the outputs count as done
+    with profiler.stage('output', 'flush'):
+        output.writer.close()
+
+    if args.index:
+        fingerprints = {conv: entry['fingerprint'] for conv, entry in conversations.items()}
+        count = word_index.build(args.source, fingerprints, stream=args.stream, jobs=args.jobs,
+                                 rebuild=args.rebuild_cache)
+        print('Word index: {} conversations indexed'.format(count))
+
+    # Only recorded once every output is written, so an interrupted run is
+    # redone by the next incremental run, and only if every kind of output was
+    # written, so the data files or plots a run skipped are too. Approximate
+    # aggregates are never reused.
+    if not (args.approx or args.no_plots or args.plots_only or args.format != 'tsv'):
+        manifest.save(args.source, conversations)
+    if args.profile:
+        profiler.save()
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-f', '--folder', help='root messages directory')
+    parser.add_argument('-f', '--folder', nargs='+', action='append',
+                        help=('root messages directory, or the ZIP archive(s) of the download; '
+                              'repeat to merge several downloads, newest first'))
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help='reparse every conversation instead of using the cache')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only reanalyze conversations that changed since the previous run')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse message files incrementally to bound memory use')
+    parser.add_argument('--approx', action='store_true',
+                        help=('estimate the counts of large conversations from a sample of their '
+                              'message files instead of parsing them'))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to load and analyze conversations with')
+    parser.add_argument('--only', metavar='NAME[,NAME...]',
+                        help='only run these analyses (see --list)')
+    parser.add_argument('--list', action='store_true', help='list the analyses and exit')
+    parser.add_argument('--format', choices=['tsv', 'parquet', 'sqlite'], default='tsv',
+                        help=('write the data as TSV files, or as an export of the messages and '
+                              'every analysis to output/export'))
+    parser.add_argument('--resolutions', default='month', metavar='RESOLUTION[,RESOLUTION...]',
+                        help='plot the messages of each conversation per day, week, month and/or year')
+    parser.add_argument('--index', action='store_true',
+                        help='update the word index queried by word_index.py')
+    plot_mode = parser.add_mutually_exclusive_group()
+    plot_mode.add_argument('--no-plots', action='store_true',
+                           help='only write the data files, skipping all plots')
+    plot_mode.add_argument('--plots-only', action='store_true',
+                           help='only draw the plots, skipping all data files')
+    parser.add_argument('--profile', action='store_true',
+                        help='print and save the time and memory of every stage to output/profile')
+    parser.add_argument('--profile-analysis', metavar='NAME',
+                        help='also run the stages of this analysis (or ingest) under cProfile')
     args = parser.parse_args()
+    if args.profile_analysis:
+        args.profile = True
+    if args.list:
+        for name, description in ANALYSES.items():
+            print('{:<30}{}'.format(name, description))
+        exit()
+    if args.approx and (args.incremental or args.format != 'tsv'):
+        print('Error: --approx cannot be combined with --incremental or --format')
+        exit()
+    if args.format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        print('Error: --format parquet requires pyarrow (pip install pyarrow)')
+        exit()
+    args.resolutions = [r.strip() for r in args.resolutions.split(',') if r.strip()]
+    unknown = [r for r in args.resolutions if r not in ['day', 'week', 'month', 'year']]
+    if unknown:
+        print('Error: unknown resolutions: ' + ', '.join(unknown))
+        exit()
+    if args.only:
+        args.only = [name.strip() for name in args.only.split(',') if name.strip()]
+        unknown = [name for name in args.only if name not in ANALYSES]
+        if unknown:
+            print('Error: unknown analyses: {} (see --list)'.format(', '.join(unknown)))
+            exit()
+        # always run in the usual order
+        args.only = [name for name in ANALYSES if name in args.only]
+    else:
+        args.only = list(ANALYSES)
 
     if not args.folder:
         if os.path.isdir(os.path.join('messages', 'inbox')):
-            args.folder = os.path.join('messages', 'inbox')
+            args.folder = [[os.path.join('messages', 'inbox')]]
         else:
             print((
                 'Error: must specify path to messages directory or have '
                 'the messages/inbox directory in current directory'
             ))
             exit()
+    import sources
+    try:
+        args.source = sources.open_sources(args.folder)
+    except ValueError as e:
+        print('Error: ' + str(e))
+        exit()
     return args
 
 
+def analysis_options(function, args):
+    """Returns the command line options a function of an analysis (e.g. its
+    run or tables function) accepts, as keyword arguments.
+    """
+    parameters = inspect.signature(function).parameters
+    options = {'resolutions': args.resolutions}
+    return {name: value for name, value in options.items() if name in parameters}
+
+
 def print_warning_message():
     """Prepares the output directory. If a directory with the same name already
     exists, warns the user before deleting it.
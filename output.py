@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+WRITE_THREADS = 8  # the number of output files written at once
+MAX_PENDING = 256  # the most files queued before write blocks
+TEMP_SUFFIX = '.tmp'
+DATA_SUFFIXES = ('.tsv', '.npz')  # the data files written by the analyses
+PLOT_SUFFIXES = ('.png',)  # the plots drawn by plots.render
+
+
+class Writer:
+    """Writes the output files from a pool of background threads, so the
+    analyses and plots never wait on the disk, however slow it is to create
+    or write each file.
+
+    Every file is written with a single call to a temporary file next to it,
+    which is then renamed over the file, so each file is always either its
+    previous or its new version, even if the run crashes. Output directories
+    are claimed instead of being emptied up front: the files of a claimed
+    directory which were not written again are only removed once every other
+    file has been written (see close). A directory can be claimed for some
+    kinds of files only, so that e.g. a run which draws no plots keeps the
+    plots of a previous run.
+    """
+
+    def __init__(self, threads=WRITE_THREADS):
+        self._threads = threads
+        self._executor = None
+        self._pending = []  # the futures of the queued files, oldest first
+        self._claimed = {}  # directory -> the claimed suffixes, or None for every file
+        self._written = set()
+        self._directories = set()  # the directories known to exist
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # a forked worker process (e.g. of plots.render_all) has none of its
+        # parent's threads, and only writes its own files
+        self._executor = None
+        self._pending = []
+        self._claimed = {}
+        self._written = set()
+        self._lock = threading.Lock()
+
+    def claim(self, path, suffixes=None):
+        """Marks a directory (and its subdirectories) as only holding the
+        files written by this run.
+
+        Args:
+            path (str): the path to the directory.
+            suffixes (tuple of str, optional): if given, only the files ending
+                with one of these (e.g. DATA_SUFFIXES) are claimed, and every
+                other file is kept.
+        """
+        path = os.path.normpath(path)
+        if suffixes is None or self._claimed.get(path, ()) is None:
+            self._claimed[path] = None
+        else:
+            self._claimed[path] = self._claimed.get(path, ()) + tuple(suffixes)
+
+    def write(self, path, data):
+        """Queues a file to be written, replacing any existing file.
+
+        Args:
+            path (str): the path to the file. Its directory is created if
+                necessary.
+            data (str or bytes): the contents of the file.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._threads,
+                                                thread_name_prefix='output')
+        if len(self._pending) >= MAX_PENDING:
+            self._pending.pop(0).result()
+        self._written.add(os.path.normpath(path))
+        self._pending.append(self._executor.submit(self._write, path, data))
+
+    def written_elsewhere(self, path):
+        """Records a file written by another process (e.g. a worker of
+        plots.render_all), so that close keeps it.
+        """
+        self._written.add(os.path.normpath(path))
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        with self._lock:
+            if directory not in self._directories:
+                os.makedirs(directory, exist_ok=True)
+                self._directories.add(directory)
+        temp = path + TEMP_SUFFIX
+        with open(temp, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def flush(self):
+        """Waits until every queued file is written, raising the first error
+        any write raised.
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def stop(self):
+        """Waits until every queued file is written (see flush), then stops
+        the writing threads, e.g. so that a process can be forked without
+        any threads running. They are started again by the next write.
+        """
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def close(self):
+        """Writes every queued file, then removes the claimed files which were
+        not written (and the claimed directories if nothing is left in them).
+        """
+        self.stop()
+        for directory, suffixes in self._claimed.items():
+            for root, _, files in os.walk(directory, topdown=False):
+                for file in files:
+                    path = os.path.normpath(os.path.join(root, file))
+                    if (suffixes is None or file.endswith(suffixes)) and path not in self._written:
+                        os.remove(path)
+                if not os.listdir(root):
+                    os.rmdir(root)
+        self._claimed.clear()
+        self._written.clear()
+
+
+writer = Writer()
@@ -0,0 +1,186 @@
+import io
+import numpy as np
+import os
+
+import output
+
+N = 20  # the number of people to plot
+
+
+def aggregate(conversation):
+    """Counts the messages, characters and reacts of everyone in a
+    conversation, and who reacted to whom, with a few vector operations over
+    the conversation's columns.
+
+    Args:
+        conversation (ingest.Conversation): the conversation to analyze.
+
+    Returns:
+        a dict of the people of the conversation (everyone who sent a message
+        or reacted, and the current participants) and their counts as arrays
+        with an entry per person, plus the reactions as (actor, receiver,
+        count) arrays of indices into people.
+    """
+    people = list(conversation.names)
+    people.extend(person for person in conversation.participants if person not in conversation.names)
+    n = len(people)
+    senders = np.asarray(conversation.sender_ids)
+    receivers = senders[conversation.react_message]
+    actors = np.asarray(conversation.react_actor)
+
+    pairs, counts = np.unique(actors.astype(np.int64) * n + receivers, return_counts=True)
+    return {
+        'name': conversation.name,
+        'people': people,
+        'messages': conversation.scaled(np.bincount(senders, minlength=n)),
+        'characters': conversation.scaled(np.bincount(senders, weights=conversation.char_counts,
+                                                      minlength=n).astype(np.int64)),
+        'reacts_given': conversation.scaled(np.bincount(actors, minlength=n)),
+        'reacts_received': conversation.scaled(np.bincount(receivers, minlength=n)),
+        'reactions': (pairs // max(n, 1), pairs % max(n, 1), conversation.scaled(counts)),
+    }
+
+
+def index(results):
+    """Merges the people of every conversation into a global index. Every
+    person gets a global id (their position in the sorted names), each
+    conversation's people are mapped to those ids in one lookup, and the
+    graphs are built as sparse coordinate (COO) arrays whose duplicate
+    entries are summed by sorting, so nothing is ever looped over per person
+    or per pair of people.
+
+    The co-participation graph weighs each pair of people by the number of
+    conversations they share, which has an entry per pair of people of each
+    conversation. The reaction graph weighs each (actor, receiver) pair by the
+    number of reacts.
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+
+    Returns:
+        a dict of the people's names, their number of conversations, messages,
+        characters and reacts given and received (all arrays indexed by id),
+        and the co_participation and reactions graphs as (row, column, weight)
+        arrays of ids, sorted by row and column. The co-participation graph is
+        symmetric and has no diagonal.
+    """
+    results = [result for result in results if result is not None]
+    names, ids = np.unique(np.array([person for result in results for person in result['people']],
+                                    dtype=object), return_inverse=True)
+    n = len(names)
+    offsets = np.cumsum([0] + [len(result['people']) for result in results])
+    people = {
+        'names': names.tolist(),
+        'conversations': np.bincount(ids, minlength=n),
+    }
+    for column in ['messages', 'characters', 'reacts_given', 'reacts_received']:
+        people[column] = np.bincount(ids, weights=np.concatenate(
+            [result[column] for result in results] + [np.zeros(0)]), minlength=n).astype(np.int64)
+
+    rows = []
+    columns = []
+    for i in range(len(results)):
+        members = ids[offsets[i]:offsets[i + 1]]
+        rows.append(np.repeat(members, len(members)))
+        columns.append(np.tile(members, len(members)))
+    people['co_participation'] = _coo(np.concatenate(rows + [np.zeros(0, dtype=np.int64)]),
+                                      np.concatenate(columns + [np.zeros(0, dtype=np.int64)]),
+                                      None, n, diagonal=False)
+
+    actors = [ids[offsets[i] + result['reactions'][0]] for i, result in enumerate(results)]
+    receivers = [ids[offsets[i] + result['reactions'][1]] for i, result in enumerate(results)]
+    people['reactions'] = _coo(np.concatenate(actors + [np.zeros(0, dtype=np.int64)]),
+                               np.concatenate(receivers + [np.zeros(0, dtype=np.int64)]),
+                               np.concatenate([result['reactions'][2] for result in results]
+                                              + [np.zeros(0, dtype=np.int64)]), n)
+    return people
+
+
+def _coo(rows, columns, weights, n, diagonal=True):
+    # sums the weights (1 each if None) of duplicate (row, column) entries
+    n = max(n, 1)
+    keys = rows.astype(np.int64) * n + columns
+    if not diagonal:
+        keep = rows != columns
+        keys = keys[keep]
+        weights = None if weights is None else weights[keep]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    weights = np.bincount(inverse, weights=weights, minlength=len(keys)).astype(np.int64)
+    return keys // n, keys % n, weights
+
+
+def run(results, write_data=True):
+    """Writes every person's counts across all conversations and the
+    co-participation and reaction graphs, and returns the plot specs (see
+    plots.render).
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+        write_data (bool, optional): whether to write the data files.
+    """
+    people = index(results)
+    names = people['names']
+    order = np.argsort(-people['messages'], kind='stable').tolist()
+
+    # Create data files
+    if write_data:
+        folder = os.path.join('output', 'people')
+        output.writer.claim(folder, output.DATA_SUFFIXES)
+        columns = ['conversations', 'messages', 'characters', 'reacts_given', 'reacts_received']
+        counts = {column: people[column].tolist() for column in columns}
+        lines = ['\t'.join(['person'] + columns) + '\n']
+        for i in order:
+            lines.append('\t'.join([names[i]] + [str(counts[column][i]) for column in columns]) + '\n')
+        output.writer.write(os.path.join(folder, 'people.tsv'), ''.join(lines))
+        for graph, header in [('co_participation', ['person', 'other', 'conversations']),
+                              ('reactions', ['actor', 'receiver', 'count'])]:
+            rows, cols, weights = (array.tolist() for array in people[graph])
+            lines = ['\t'.join(header) + '\n']
+            for row, col, weight in zip(rows, cols, weights):
+                # the co-participation graph is symmetric, so each pair is written once
+                if graph == 'reactions' or row < col:
+                    lines.append('\t'.join([names[row], names[col], str(weight)]) + '\n')
+            output.writer.write(os.path.join(folder, graph + '.tsv'), ''.join(lines))
+        # the graphs as sparse matrices, e.g. for scipy.sparse.coo_matrix((weights, (rows, columns)))
+        data = io.BytesIO()
+        np.savez_compressed(data, names=np.array(names, dtype=str), **{
+            '{}_{}'.format(graph, part): array
+            for graph in ['co_participation', 'reactions']
+            for part, array in zip(['rows', 'columns', 'weights'], people[graph])})
+        output.writer.write(os.path.join(folder, 'graphs.npz'), data.getvalue())
+
+    # Create plot
+    return [{
+        'kind': 'bar',
+        'path': os.path.join('output', 'people', 'top_people.png'),
+        'x': [names[i] for i in order[:N]],
+        'y': [int(people['messages'][i]) for i in order[:N]],
+        'title': 'Top People by Message Count',
+        'ylabel': 'Messages',
+    }]
+
+
+def tables(results):
+    """Returns every person's counts across all conversations and the
+    co-participation and reaction graphs as tables (see export.export_tables).
+    """
+    people = index(results)
+    names = np.array(people['names'], dtype=object)
+    rows, cols, weights = people['co_participation']
+    actors, receivers, counts = people['reactions']
+    return {
+        'people': {
+            'person': people['names'],
+            'conversations': people['conversations'],
+            'messages': people['messages'],
+            'characters': people['characters'],
+            'reacts_given': people['reacts_given'],
+            'reacts_received': people['reacts_received'],
+        },
+        'people_co_participation': {
+            'person': names[rows], 'other': names[cols], 'conversations': weights,
+        },
+        'people_reactions': {
+            'actor': names[actors], 'receiver': names[receivers], 'count': counts,
+        },
+    }
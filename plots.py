@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import time
+
+import output
+from profiling import peak_rss_mb
+
+FIGSIZE = (14, 6.5)  # the default size of every plot (in inches)
+
+
+def render(spec):
+    """Draws a plot and saves it as an image. Uses the Agg backend and the
+    object-oriented Figure API, so it never touches pyplot's global state and
+    is safe to run in parallel.
+
+    Args:
+        spec (dict): a description of the plot to draw, with keys
+            kind: one of 'hist', 'bar', 'line', 'subcategorybar', 'heatmap' and
+                'pies'.
+            path: the file to save the plot to (see output.Writer.write).
+            x, y: the data to plot (for 'hist' only x). For 'subcategorybar'
+                x is the list of categories and y the list of subcategory
+                values (see utils.subcategorybar). For 'heatmap' x and y are
+                the column and row labels.
+            z: for 'heatmap' only, the matrix of values (rows x columns).
+            pies: for 'pies' only, a list of dicts with the values, labels and
+                title of each pie chart, which are drawn side by side.
+            title, xlabel, ylabel, legend (optional): the plot's labels.
+            figsize (optional): the figure's size, defaulting to FIGSIZE.
+    """
+    # Imported here so that runs which skip plotting never pay for matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import utils
+
+    fig = Figure(figsize=spec.get('figsize', FIGSIZE))
+    FigureCanvasAgg(fig)
+    kind = spec['kind']
+    if kind == 'pies':
+        axes = fig.subplots(1, len(spec['pies']), squeeze=False)[0]
+        for ax, pie in zip(axes, spec['pies']):
+            ax.pie(pie['values'], labels=pie['labels'], autopct='%1.1f%%')
+            ax.title.set_text(pie['title'])
+        fig.tight_layout()
+    else:
+        ax = fig.add_subplot()
+        if kind == 'hist':
+            ax.hist(spec['x'])
+        elif kind == 'bar':
+            ax.bar(spec['x'], spec['y'])
+        elif kind == 'line':
+            ax.plot(spec['x'], spec['y'])
+        elif kind == 'subcategorybar':
+            utils.subcategorybar(ax, spec['x'], spec['y'])
+        elif kind == 'heatmap':
+            image = ax.imshow(spec['z'], aspect='auto', cmap='viridis')
+            ax.set_xticks(range(len(spec['x'])))
+            ax.set_xticklabels(spec['x'])
+            ax.set_yticks(range(len(spec['y'])))
+            ax.set_yticklabels(spec['y'])
+            fig.colorbar(image, ax=ax)
+        else:
+            raise ValueError('unknown plot kind: ' + kind)
+        if 'title' in spec:
+            ax.set_title(spec['title'])
+        if 'xlabel' in spec:
+            ax.set_xlabel(spec['xlabel'])
+        if 'ylabel' in spec:
+            ax.set_ylabel(spec['ylabel'])
+        if 'legend' in spec:
+            ax.legend(spec['legend'])
+    # the image is encoded in memory and written in the background (see output.Writer)
+    image = io.BytesIO()
+    fig.savefig(image, format=os.path.splitext(spec['path'])[1][1:], bbox_inches='tight')
+    output.writer.write(spec['path'], image.getvalue())
+
+
+def _render_timed(spec):
+    begin = time.perf_counter()
+    render(spec)
+    return time.perf_counter() - begin, peak_rss_mb()
+
+
+def _render_in_worker(specs):
+    # a worker's images must all be written before its results are returned
+    timings = [_render_timed(spec) for spec in specs]
+    output.writer.flush()
+    return timings
+
+
+def render_all(specs, jobs=1):
+    """Draws every plot, in a pool of worker processes if jobs > 1.
+
+    Args:
+        specs (list of dict): the plots to draw (see render).
+        jobs (int, optional): the number of worker processes to use.
+
+    Returns:
+        a list of the time (in seconds) each plot took to draw and the peak
+        memory use (in MB) of the process that drew it.
+    """
+    # Only the plots of the directories drawn into are replaced, so any other
+    # output files in them are kept
+    for directory in {os.path.dirname(spec['path']) for spec in specs}:
+        output.writer.claim(directory, output.PLOT_SUFFIXES)
+    if jobs > 1 and len(specs) > 1:
+        # forking while the writer's threads are writing can deadlock the
+        # workers, so they are stopped first
+        output.writer.stop()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(specs) // (jobs * 4))
+            chunks = [specs[i:i + chunksize] for i in range(0, len(specs), chunksize)]
+            for spec in specs:
+                output.writer.written_elsewhere(spec['path'])
+            return [timing for timings in executor.map(_render_in_worker, chunks) for timing in timings]
+    return [_render_timed(spec) for spec in specs]
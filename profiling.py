@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+import cProfile
+import glob
+import json
+import os
+import pstats
+import shutil
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # e.g. on Windows
+    resource = None
+
+PROFILE_FOLDER = os.path.join('output', 'profile')
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process so far (in MB), or
+    0 if the platform does not report it.
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Profiler:
+    """Records the wall time, bytes read, messages processed and peak memory of
+    each stage (discover, load, aggregate, write, plot) of each analysis,
+    optionally per conversation. When disabled, stages cost a single attribute
+    check, so the instrumentation can stay in place permanently.
+
+    Attributes:
+        enabled (bool): whether stages are recorded.
+        records (list of dict): the recorded stages, in the order they ended.
+        cprofile_analysis (str): the name of an analysis whose stages are also
+            run under cProfile, or None.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.cprofile_analysis = None
+        self._cprofile = None
+
+    def enable(self, cprofile_analysis=None):
+        """Starts recording, discarding the results of any previous run.
+
+        Args:
+            cprofile_analysis (str, optional): see cprofile_analysis.
+        """
+        self.enabled = True
+        self.cprofile_analysis = cprofile_analysis
+        shutil.rmtree(PROFILE_FOLDER, ignore_errors=True)
+
+    @contextmanager
+    def stage(self, analysis, stage, conversation=None):
+        """Records the stage run inside the with block. Yields a dict which the
+        block may fill with 'bytes_read' and 'messages' counts.
+
+        Args:
+            analysis (str): the analysis (or 'ingest') the stage belongs to.
+            stage (str): the name of the stage.
+            conversation (str, optional): the conversation being processed.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        counters = {}
+        cprofile = analysis == self.cprofile_analysis
+        if cprofile:
+            if self._cprofile is None:
+                self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        begin = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            seconds = time.perf_counter() - begin
+            if cprofile:
+                self._cprofile.disable()
+            self.add(analysis, stage, seconds, conversation, **counters)
+
+    def add(self, analysis, stage, seconds, conversation=None, bytes_read=0, messages=0,
+            peak_rss=None):
+        """Records a stage that was timed elsewhere (e.g. in another process)."""
+        self.records.append({
+            'analysis': analysis,
+            'stage': stage,
+            'conversation': conversation,
+            'seconds': seconds,
+            'bytes_read': bytes_read,
+            'messages': messages,
+            'peak_rss_mb': peak_rss_mb() if peak_rss is None else peak_rss,
+            'pid': os.getpid(),
+        })
+
+    def take_records(self):
+        """Returns and forgets the records so far, so that worker processes can
+        send them back to the parent.
+        """
+        self._dump_cprofile()
+        records = self.records
+        self.records = []
+        return records
+
+    def _dump_cprofile(self):
+        # each process dumps its own stats, which are merged by save()
+        if self._cprofile is not None:
+            os.makedirs(PROFILE_FOLDER, exist_ok=True)
+            self._cprofile.dump_stats(os.path.join(
+                PROFILE_FOLDER, '{}.{}.prof'.format(self.cprofile_analysis, os.getpid())))
+
+    def summary(self):
+        """Returns the records totalled per (analysis, stage), in the order the
+        stages first ran.
+        """
+        totals = {}
+        for record in self.records:
+            key = (record['analysis'], record['stage'])
+            if key not in totals:
+                totals[key] = {'analysis': key[0], 'stage': key[1], 'calls': 0, 'seconds': 0.0,
+                               'bytes_read': 0, 'messages': 0, 'peak_rss_mb': 0.0}
+            total = totals[key]
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            total['bytes_read'] += record['bytes_read']
+            total['messages'] += record['messages']
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+        return list(totals.values())
+
+    def save(self):
+        """Prints the summary table and writes it, the full trace and the merged
+        cProfile stats (if any) to PROFILE_FOLDER.
+        """
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        self._dump_cprofile()
+        header = ['analysis', 'stage', 'calls', 'seconds', 'mb_read', 'messages', 'peak_rss_mb']
+        rows = [[
+            s['analysis'], s['stage'], str(s['calls']), '{:.3f}'.format(s['seconds']),
+            '{:.1f}'.format(s['bytes_read'] / 1e6), str(s['messages']), '{:.1f}'.format(s['peak_rss_mb']),
+        ] for s in self.summary()]
+        widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+        for row in [header] + rows:
+            print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+        with open(os.path.join(PROFILE_FOLDER, 'summary.tsv'), 'w') as f:
+            for row in [header] + rows:
+                f.write('\t'.join(row) + '\n')
+        with open(os.path.join(PROFILE_FOLDER, 'trace.json'), 'w') as f:
+            json.dump(self.records, f)
+
+        if self.cprofile_analysis is not None:
+            dumps = glob.glob(os.path.join(PROFILE_FOLDER, self.cprofile_analysis + '.*.prof'))
+            if dumps:
+                path = os.path.join(PROFILE_FOLDER, self.cprofile_analysis + '.prof')
+                pstats.Stats(*dumps).dump_stats(path)
+                for dump in dumps:
+                    os.remove(dump)
+                print('cProfile stats of {} written to {}'.format(self.cprofile_analysis, path))
+
+
+profiler = Profiler()
@@ -0,0 +1,161 @@
+import numpy as np
+import os
+
+import config
+import output
+
+PER_CONVERSATION = True  # outputs are written per conversation (see messenger_stats.main)
+SESSION_GAP = 6 * 60 * 60 * 1000  # the inactivity (in ms) after which a new session starts
+PERCENTILES = [50, 90, 99]
+
+def aggregate(conversation):
+    """Splits a conversation into sessions and turns, and measures how long
+    each participant takes to reply.
+
+    A session is a run of messages without a gap longer than SESSION_GAP, and
+    a turn is a run of consecutive messages by the same person within a
+    session. The first message of every turn but the first of its session is a
+    reply, sent after the time since the previous (other person's) message.
+    Everything is computed with a few vector operations over the time sorted
+    columns, by run-length encoding the senders.
+
+    Args:
+        conversation (ingest.Conversation): the conversation to analyze.
+
+    Returns:
+        a dict of the people who sent messages and their reply time and turn
+        length percentiles, plus the sessions, or None if the conversation is
+        too small to analyze or is a sample (which has no consecutive messages
+        to measure replies between).
+    """
+    if len(conversation) < config.MIN_MESSAGE_COUNT or conversation.scale != 1:
+        return None
+
+    order = np.argsort(conversation.timestamps, kind='stable')
+    timestamps = np.asarray(conversation.timestamps)[order]
+    senders = np.asarray(conversation.sender_ids)[order]
+    n = len(timestamps)
+
+    session_start = np.ones(n, dtype=bool)
+    session_start[1:] = np.diff(timestamps) > SESSION_GAP
+    turn_start = session_start.copy()
+    turn_start[1:] |= senders[1:] != senders[:-1]
+
+    turns = np.flatnonzero(turn_start)
+    turn_lengths = np.diff(np.append(turns, n))
+    turn_senders = senders[turns]
+    replies = turns[~session_start[turns]]
+    reply_times = timestamps[replies] - timestamps[replies - 1]
+    reply_senders = senders[replies]
+
+    sessions = np.flatnonzero(session_start)
+    session_ends = np.append(sessions[1:], n)
+    session_turns = np.add.reduceat(turn_start.astype(np.int64), sessions)
+
+    people = np.flatnonzero(np.bincount(senders, minlength=len(conversation.names)))
+    reply_percentiles = np.full((len(people), len(PERCENTILES)), np.nan)
+    turn_percentiles = np.full((len(people), len(PERCENTILES)), np.nan)
+    for i, person in enumerate(people):
+        times = reply_times[reply_senders == person]
+        if len(times):
+            reply_percentiles[i] = np.percentile(times, PERCENTILES) / 1000
+        turn_percentiles[i] = np.percentile(turn_lengths[turn_senders == person], PERCENTILES)
+
+    return {
+        'name': conversation.name,
+        'people': [conversation.names[person] for person in people],
+        'replies': np.bincount(reply_senders, minlength=len(conversation.names))[people],
+        'reply_percentiles': reply_percentiles,
+        'turns': np.bincount(turn_senders, minlength=len(conversation.names))[people],
+        'turn_percentiles': turn_percentiles,
+        'sessions': np.stack([timestamps[sessions], timestamps[session_ends - 1],
+                              session_ends - sessions, session_turns], axis=1),
+    }
+
+
+def run(results, write_data=True):
+    """Writes the reply time and turn length percentiles and the sessions of
+    each conversation, and returns the plot specs (see plots.render).
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+        write_data (bool, optional): whether to write the data files.
+    """
+    specs = []
+    for result in results:
+        if result is None:
+            continue
+        conv = result['name']
+        people = result['people']
+        reply_percentiles = result['reply_percentiles'].tolist()
+
+        # Create data files
+        if write_data:
+            output.writer.claim(os.path.join('output', 'reply_times', conv), output.DATA_SUFFIXES)
+            lines = ['\t'.join(
+                ['person', 'replies']
+                + ['reply_seconds_p{}'.format(p) for p in PERCENTILES]
+                + ['turns']
+                + ['turn_length_p{}'.format(p) for p in PERCENTILES]
+            ) + '\n']
+            for i, person in enumerate(people):
+                lines.append('\t'.join(
+                    [person, str(result['replies'][i])]
+                    + [_format(p) for p in reply_percentiles[i]]
+                    + [str(result['turns'][i])]
+                    + [_format(p) for p in result['turn_percentiles'][i].tolist()]
+                ) + '\n')
+            output.writer.write(os.path.join('output', 'reply_times', conv, 'summary.tsv'), ''.join(lines))
+            lines = ['\t'.join(['start', 'end', 'messages', 'turns']) + '\n']
+            for session in result['sessions'].tolist():
+                lines.append('\t'.join(str(value) for value in session) + '\n')
+            output.writer.write(os.path.join('output', 'reply_times', conv, 'sessions.tsv'), ''.join(lines))
+
+        # Create plot
+        specs.append({
+            'kind': 'bar',
+            'path': os.path.join('output', 'reply_times', conv, 'median_reply_time.png'),
+            'x': people,
+            'y': [0 if np.isnan(p[0]) else p[0] / 60 for p in reply_percentiles],
+            'title': 'Median Reply Time',
+            'ylabel': 'Minutes',
+        })
+    return specs
+
+
+def tables(results):
+    """Returns the reply time and turn length percentiles and the sessions of
+    every conversation as tables (see export.export_tables).
+    """
+    results = [result for result in results if result is not None]
+    summary = {
+        'conversation': [result['name'] for result in results for _ in result['people']],
+        'person': [person for result in results for person in result['people']],
+        'replies': np.concatenate([result['replies'] for result in results]
+                                  + [np.zeros(0, dtype=np.int64)]),
+        'turns': np.concatenate([result['turns'] for result in results]
+                                + [np.zeros(0, dtype=np.int64)]),
+    }
+    for column in ['reply_percentiles', 'turn_percentiles']:
+        percentiles = np.concatenate([result[column] for result in results]
+                                     + [np.zeros((0, len(PERCENTILES)))])
+        for i, p in enumerate(PERCENTILES):
+            name = 'reply_seconds_p{}' if column == 'reply_percentiles' else 'turn_length_p{}'
+            summary[name.format(p)] = percentiles[:, i]
+    sessions = np.concatenate([result['sessions'] for result in results]
+                              + [np.zeros((0, 4), dtype=np.int64)])
+    return {
+        'reply_times': summary,
+        'reply_sessions': {
+            'conversation': [result['name'] for result in results for _ in result['sessions']],
+            'start': sessions[:, 0],
+            'end': sessions[:, 1],
+            'messages': sessions[:, 2],
+            'turns': sessions[:, 3],
+        },
+    }
+
+
+def _format(value):
+    # people who never replied have no percentiles
+    return '' if np.isnan(value) else '{:.1f}'.format(value)
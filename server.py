@@ -0,0 +1,193 @@
+import argparse
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib
+import inspect
+import json
+import math
+import os
+import threading
+import time
+import traceback
+from urllib.parse import parse_qs, urlparse
+
+import ingest
+import messenger_stats
+import sources
+import utils
+
+QUERY_CACHE_SIZE = 256  # the number of query results kept in memory
+
+
+class Inbox:
+    """Every conversation of a source, loaded once and kept in memory, which
+    answers the analyses' queries.
+
+    Attributes:
+        conversations (dict): conversation folder name -> ingest.Conversation.
+    """
+
+    def __init__(self, source, rebuild_cache=False, stream=False):
+        self.conversations = {conversation.name: conversation for conversation in
+                              ingest.load_conversations(source, rebuild_cache=rebuild_cache,
+                                                        stream=stream)}
+        self._aggregates = {}  # analysis name -> { conversation name -> aggregate }
+        self._lock = threading.Lock()
+        self.query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._query)
+
+    def list_conversations(self, filters=()):
+        """Returns the title and size of the conversations matching the filters
+        (see utils.filter_conversations).
+        """
+        convs = utils.filter_conversations(list(self.conversations), filters)
+        return {'conversations': {
+            'name': convs,
+            'title': [self.conversations[conv].title for conv in convs],
+            'count': [len(self.conversations[conv]) for conv in convs],
+        }}
+
+    def aggregates(self, name):
+        """Returns every conversation's aggregate for an analysis, which are
+        only computed the first time they are needed.
+        """
+        with self._lock:
+            if name not in self._aggregates:
+                analysis = importlib.import_module(name)
+                self._aggregates[name] = {conv: analysis.aggregate(conversation)
+                                          for conv, conversation in self.conversations.items()}
+            return self._aggregates[name]
+
+    def _query(self, name, filters=(), params=()):
+        """Returns the tables of an analysis (see export.export_tables) over
+        the conversations matching the filters. Results are cached by query, so
+        all of the arguments must be hashable.
+
+        Args:
+            name (str): the analysis.
+            filters (tuple of str, optional): see utils.filter_conversations.
+            params (tuple, optional): (name, value) pairs of the keyword
+                arguments of the analysis' tables function, e.g.
+                (('time_interval', 7),).
+        """
+        analysis = importlib.import_module(name)
+        aggregates = self.aggregates(name)
+        convs = utils.filter_conversations(list(aggregates), filters)
+        return analysis.tables([aggregates[conv] for conv in convs], **dict(params))
+
+
+def query_parameters(name, query):
+    """Converts the parameters of a query string to the keyword arguments of
+    an analysis' tables function, with the types of their defaults.
+
+    Returns:
+        a sorted tuple of (name, value) pairs.
+
+    Raises:
+        ValueError: if the analysis has no such parameter, a value is not of
+            the right type, or a number (e.g. a count or an interval) is less
+            than 1.
+    """
+    parameters = inspect.signature(importlib.import_module(name).tables).parameters
+    params = []
+    for key, values in query.items():
+        if key == 'filter':
+            continue
+        if key not in parameters or parameters[key].default is inspect.Parameter.empty:
+            raise ValueError('{} has no parameter {}'.format(name, key))
+        default = parameters[key].default
+        if isinstance(default, list):
+            value = tuple(values[-1].split(','))
+        else:
+            value = int(values[-1]) if default is None else type(default)(values[-1])
+            if isinstance(value, int) and value < 1:
+                raise ValueError('{} must be at least 1'.format(key))
+        params.append((key, value))
+    return tuple(sorted(params))
+
+
+def _jsonable(tables):
+    # arrays become lists, and NaN (e.g. a percentile of nothing) null
+    return {table: {column: [None if isinstance(value, float) and math.isnan(value) else value
+                             for value in (values.tolist() if hasattr(values, 'tolist') else values)]
+                    for column, values in columns.items()}
+            for table, columns in tables.items()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers GET requests for
+        /analyses: the available analyses.
+        /conversations?filter=...: the conversations' titles and sizes.
+        /analyses/<name>?filter=...&<parameter>=...: an analysis' tables.
+    with JSON. Every filter parameter must be a substring of the conversation
+    folder names.
+    """
+
+    inbox = None  # set by serve
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        filters = tuple(query.get('filter', []))
+        parts = [part for part in url.path.split('/') if part]
+        begin = time.perf_counter()
+        try:
+            if parts == ['analyses']:
+                body = {'analyses': messenger_stats.ANALYSES}
+            elif parts == ['conversations']:
+                body = self.inbox.list_conversations(filters)
+            elif len(parts) == 2 and parts[0] == 'analyses' and parts[1] in messenger_stats.ANALYSES:
+                body = self.inbox.query(parts[1], filters, query_parameters(parts[1], query))
+            else:
+                return self._send(404, {'error': 'not found: ' + url.path})
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        except Exception as e:
+            # the client still gets an answer, and the server keeps serving
+            traceback.print_exc()
+            return self._send(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+        self._send(200, _jsonable(body) if parts != ['analyses'] else body,
+                   time.perf_counter() - begin)
+
+    def _send(self, status, body, seconds=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if seconds is not None:
+            self.send_header('Server-Timing', 'query;dur={:.1f}'.format(seconds * 1000))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(inbox, host='127.0.0.1', port=8000):
+    """Answers queries about an Inbox until interrupted."""
+    Handler.inbox = inbox
+    server = ThreadingHTTPServer((host, port), Handler)
+    print('Serving {} conversations on http://{}:{}/'.format(len(inbox.conversations), host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Loads the messages once and answers queries about them over HTTP.')
+    parser.add_argument('-f', '--folder', nargs='+', action='append',
+                        help='as for messenger_stats.py, defaults to messages/inbox')
+    parser.add_argument('--host', default='127.0.0.1', help='the address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='the port to listen on')
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help='reparse every conversation instead of using the cache')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse message files incrementally to bound memory use')
+    args = parser.parse_args()
+
+    try:
+        source = sources.open_sources(args.folder or [[os.path.join('messages', 'inbox')]])
+    except ValueError as e:
+        print('Error: ' + str(e))
+        exit()
+    serve(Inbox(source, args.rebuild_cache, args.stream), args.host, args.port)
@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import zipfile
+
+import config
+
+
+
+class FolderSource:
+    """Reads conversations from an extracted messages folder.
+
+    Attributes:
+        path (str): the path to the folder containing the conversation folders
+            (e.g. messages/inbox).
+        name (str): identifies the source across runs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.abspath(path)
+
+    def list_conversations(self):
+        """Returns the names of the conversation folders."""
+        return [conv for conv in os.listdir(self.path)
+                if os.path.isfile(os.path.join(self.path, conv, config.MESSAGE_FILE.format(1)))]
+
+    def fingerprint(self, conv):
+        """Returns a description of a conversation's message files which changes
+        whenever any of the files is modified, added or removed.
+
+        Args:
+            conv (str): the name of the conversation folder.
+
+        Returns:
+            a list of [file name, size, modification time (ns)] entries.
+        """
+        files = []
+        message_id = 1
+        while True:
+            file_name = config.MESSAGE_FILE.format(message_id)
+            try:
+                st = os.stat(os.path.join(self.path, conv, file_name))
+            except FileNotFoundError:
+                break
+            files.append([file_name, st.st_size, st.st_mtime_ns])
+            message_id += 1
+        return files
+
+    def location(self, conv):
+        """Returns a string identifying where a conversation is read from."""
+        return os.path.abspath(os.path.join(self.path, conv))
+
+    def open(self, conv, file_name):
+        """Opens one of a conversation's message files for reading in binary
+        mode, raising FileNotFoundError if it does not exist.
+        """
+        return open(os.path.join(self.path, conv, file_name), 'rb')
+
+
+class ZipSource:
+    """Reads conversations directly from one or more of the ZIP archives
+    Facebook's download is split into, without extracting them. Only the
+    archives' central directories are read to find the conversations, and only
+    the message files are ever decompressed, so photos, videos and other media
+    are skipped entirely.
+
+    Attributes:
+        paths (list of str): the paths to the archives.
+        name (str): identifies the source across runs.
+    """
+
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.name = '|'.join(self.paths)
+        self._archives = {}
+
+        # matches the message files of a conversation inside an archive, e.g.
+        # messages/inbox/<conversation>/message_1.json
+        pattern = re.compile(r'(?:^|/)inbox/([^/]+)/'
+                             + re.escape(config.MESSAGE_FILE).replace(r'\{\}', r'(\d+)') + '$')
+
+        # conversation -> { file name -> (archive path, member name, size, CRC) }
+        self._index = {}
+        with ThreadPoolExecutor(max_workers=len(self.paths)) as executor:
+            for path, infos in zip(self.paths, executor.map(_read_central_directory, self.paths)):
+                for info in infos:
+                    match = pattern.search(info.filename)
+                    if match is None:
+                        continue
+                    file_name = config.MESSAGE_FILE.format(int(match.group(2)))
+                    self._index.setdefault(match.group(1), {})[file_name] = \
+                        (path, info.filename, info.file_size, info.CRC)
+
+    def __getstate__(self):
+        # open archives can't be sent to worker processes, each opens its own
+        state = dict(self.__dict__)
+        state['_archives'] = {}
+        return state
+
+    def list_conversations(self):
+        """Returns the names of the conversation folders."""
+        return sorted(conv for conv, files in self._index.items()
+                      if config.MESSAGE_FILE.format(1) in files)
+
+    def fingerprint(self, conv):
+        """Returns a description of a conversation's message files which changes
+        whenever any of the files is modified, added or removed.
+
+        Args:
+            conv (str): the name of the conversation folder.
+
+        Returns:
+            a list of [file name, size, CRC-32] entries.
+        """
+        files = []
+        message_id = 1
+        while config.MESSAGE_FILE.format(message_id) in self._index.get(conv, {}):
+            file_name = config.MESSAGE_FILE.format(message_id)
+            _, _, size, crc = self._index[conv][file_name]
+            files.append([file_name, size, crc])
+            message_id += 1
+        return files
+
+    def location(self, conv):
+        """Returns a string identifying where a conversation is read from."""
+        return self.name + '!' + conv
+
+    def open(self, conv, file_name):
+        """Opens one of a conversation's message files for reading in binary
+        mode, raising FileNotFoundError if it does not exist.
+        """
+        if file_name not in self._index.get(conv, {}):
+            raise FileNotFoundError(self.location(conv) + '/' + file_name)
+        path, member, _, _ = self._index[conv][file_name]
+        if path not in self._archives:
+            self._archives[path] = zipfile.ZipFile(path)
+        return self._archives[path].open(member)
+
+
+class MergedSource:
+    """Merges the conversations of several exports, e.g. downloads made months
+    apart, since messages deleted since an older download are missing from the
+    newer ones. A conversation is matched across exports by its folder name,
+    and its copies are merged by ingest.merge_conversations.
+
+    Attributes:
+        sources (list): the FolderSource or ZipSource of each export, in order
+            of precedence.
+        name (str): identifies the source across runs.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.name = '+'.join(source.name for source in sources)
+        self._conversations = [set(source.list_conversations()) for source in sources]
+
+    def list_conversations(self):
+        """Returns the names of the conversation folders of every export."""
+        conversations = []
+        for source in self.sources:
+            conversations.extend(conv for conv in source.list_conversations()
+                                 if conv not in conversations)
+        return conversations
+
+    def exports(self, conv):
+        """Returns the sources of the exports which contain a conversation."""
+        return [source for source, conversations in zip(self.sources, self._conversations)
+                if conv in conversations]
+
+    def fingerprint(self, conv):
+        """Returns a description of a conversation's message files in every
+        export, which changes whenever any of the files is modified, added or
+        removed.
+
+        Args:
+            conv (str): the name of the conversation folder.
+
+        Returns:
+            a list of [export index/file name, size, modification time or CRC-32]
+            entries.
+        """
+        return [['{}/{}'.format(i, file_name), size, stamp]
+                for i, source in enumerate(self.sources)
+                for file_name, size, stamp in source.fingerprint(conv)]
+
+    def location(self, conv):
+        """Returns a string identifying where a conversation is read from."""
+        return '+'.join(source.location(conv) for source in self.sources)
+
+
+def _read_central_directory(path):
+    with zipfile.ZipFile(path) as archive:
+        return archive.infolist()
+
+
+def open_source(paths):
+    """Returns the source for the paths given on the command line.
+
+    Args:
+        paths (list of str): either a single messages folder, one or more ZIP
+            archives of the same download, or several messages folders of
+            different downloads.
+
+    Returns:
+        a FolderSource, ZipSource or MergedSource.
+    """
+    if all(zipfile.is_zipfile(path) for path in paths):
+        return ZipSource(paths)
+    if all(os.path.isdir(path) for path in paths):
+        if len(paths) == 1:
+            return FolderSource(paths[0])
+        return MergedSource([FolderSource(path) for path in paths])
+    raise ValueError('expected messages folders or the ZIP archives of a download: '
+                     + ', '.join(paths))
+
+
+def open_sources(groups):
+    """Returns the source for the exports given on the command line, merging
+    them if there is more than one.
+
+    Args:
+        groups (list of list of str): the paths of each export (see
+            open_source).
+
+    Returns:
+        a FolderSource, ZipSource or MergedSource.
+    """
+    exports = [open_source(paths) for paths in groups]
+    if len(exports) == 1:
+        return exports[0]
+    return MergedSource([source for export in exports
+                         for source in (export.sources if isinstance(export, MergedSource)
+                                        else [export])])
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import random
+
+import config
+
+
+MESSAGES_PER_FILE = 10000  # Facebook splits conversations into files of this many messages
+REACTIONS = ['👍', '👎', '😆', '😍', '😠', '😢', '😮', '❤', '😂']
+WORDS = ['hi', 'hello', 'ok', 'lol', 'the', 'and', 'you', 'what', 'time', 'tomorrow',
+         'dinner', 'café', 'naïve', 'über', '😂', '👍', '🎉']
+TIME_BEGIN = 1325376000000  # 2012-01-01 (in ms)
+TIME_END = 1577836800000  # 2020-01-01 (in ms)
+
+
+def encode(s):
+    """Mangles a string the same way Facebook's export does: the UTF-8 bytes of
+    the string are written as if they were latin-1 characters.
+    """
+    return s.encode('utf-8').decode('latin-1')
+
+
+def generate(root, conversations=100, messages=1000, participants=2, contacts=None,
+             reaction_density=0.05, content_length=30, file_size=MESSAGES_PER_FILE, seed=0):
+    """Writes a synthetic inbox in the same layout as Facebook's export, i.e.
+    root/messages/inbox/<conversation>/message_N.json.
+
+    Args:
+        root (str): the folder to create the inbox in.
+        conversations (int, optional): the number of conversations.
+        messages (int, optional): the mean number of messages per conversation.
+            Conversation sizes are exponentially distributed, so most are small
+            and a few are very large, like in a real inbox.
+        participants (int, optional): the number of participants of each
+            conversation (2 for one-on-one chats).
+        contacts (int, optional): the number of distinct people participants
+            are drawn from. Defaults to enough for every conversation to have
+            distinct participants.
+        reaction_density (float, optional): the mean number of reactions per
+            message.
+        content_length (int, optional): the mean number of characters of a
+            message's text content.
+        file_size (int, optional): the number of messages per message file.
+        seed (int, optional): seeds the random number generator, so the same
+            arguments always generate the same inbox.
+
+    Returns:
+        the path to the inbox folder (root/messages/inbox).
+    """
+    rng = random.Random(seed)
+    if contacts is None:
+        contacts = max(participants, conversations * (participants - 1) + 1)
+    people = ['Person {}'.format(i) for i in range(contacts)]
+    inbox = os.path.join(root, 'messages', 'inbox')
+
+    for c in range(conversations):
+        conv = 'conversation{}_{:08x}'.format(c, rng.getrandbits(32))
+        members = ['Person 0'] + rng.sample(people[1:], participants - 1)
+        count = max(1, int(rng.expovariate(1.0 / messages)))
+        begin = rng.randint(TIME_BEGIN, TIME_END - 1)
+        timestamps = sorted((rng.randint(begin, TIME_END) for _ in range(count)), reverse=True)
+
+        msgs = []
+        for timestamp in timestamps:
+            msg = {'sender_name': encode(rng.choice(members)), 'timestamp_ms': timestamp}
+            if rng.random() < 0.9:
+                words = []
+                length = max(1, int(rng.expovariate(1.0 / content_length)))
+                while sum(len(w) + 1 for w in words) < length:
+                    words.append(rng.choice(WORDS))
+                msg['content'] = encode(' '.join(words))
+            reactions = []
+            while rng.random() < reaction_density / (1 + reaction_density) and len(reactions) < len(members):
+                reactions.append({'reaction': encode(rng.choice(REACTIONS)),
+                                  'actor': encode(rng.choice(members))})
+            if reactions:
+                msg['reactions'] = reactions
+            msg['type'] = 'Generic'
+            msgs.append(msg)
+
+        os.makedirs(os.path.join(inbox, conv), exist_ok=True)
+        for message_id, start in enumerate(range(0, count, file_size), 1):
+            data = {
+                'participants': [{'name': encode(p)} for p in members],
+                'messages': msgs[start:start + file_size],
+                'title': encode(', '.join(members[1:]) if participants > 2 else members[1]),
+                'is_still_participant': True,
+                'thread_type': 'RegularGroup' if participants > 2 else 'Regular',
+                'thread_path': 'inbox/' + conv,
+            }
+            with open(os.path.join(inbox, conv, config.MESSAGE_FILE.format(message_id)), 'w') as f:
+                json.dump(data, f, indent=2)
+    return inbox
+
+
+def add_arguments(parser):
+    """Adds the generator's options to an argument parser."""
+    parser.add_argument('--conversations', type=int, default=100, help='number of conversations')
+    parser.add_argument('--messages', type=int, default=1000, help='mean messages per conversation')
+    parser.add_argument('--participants', type=int, default=2, help='participants per conversation')
+    parser.add_argument('--contacts', type=int, help='number of distinct people')
+    parser.add_argument('--reaction-density', type=float, default=0.05, help='mean reactions per message')
+    parser.add_argument('--content-length', type=int, default=30, help='mean characters per message')
+    parser.add_argument('--file-size', type=int, default=MESSAGES_PER_FILE, help='messages per message file')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+
+def generator_arguments(args):
+    """Returns the generate() keyword arguments from parsed arguments."""
+    return {
+        'conversations': args.conversations,
+        'messages': args.messages,
+        'participants': args.participants,
+        'contacts': args.contacts,
+        'reaction_density': args.reaction_density,
+        'content_length': args.content_length,
+        'file_size': args.file_size,
+        'seed': args.seed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a synthetic Messenger inbox.')
+    parser.add_argument('root', help='folder to create messages/inbox in')
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(generate(args.root, **generator_arguments(args)))
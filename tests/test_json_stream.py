@@ -0,0 +1,74 @@
+import io
+import json
+
+import pytest
+
+import json_stream
+
+# values which end right at, or are split across, the boundaries of small chunks
+MESSAGE_FILE = {
+    'participants': [{'name': 'ZoÃ« Z'}, {'name': 'Bob B'}],
+    'messages': [
+        {'sender_name': 'Bob B', 'timestamp_ms': 1434844397694, 'content': 'a, b: [c] {d}',
+         'reactions': [{'reaction': 'ð\u009f\u0091\u008d', 'actor': 'Bob B'}]},
+        {'sender_name': 'ZoÃ« Z', 'timestamp_ms': 1, 'content': '"quoted" \\ é'},
+        {'sender_name': 'Bob B', 'timestamp_ms': 12345678901234, 'share': {'link': None},
+         'ratio': 1.5, 'flags': [True, False, -2e3]},
+    ],
+    'title': 'ZoÃ« Z',
+    'is_still_participant': True,
+    'thread_path': 'inbox/chat_abc',
+    'joinable_mode': {'mode': 1, 'link': ''},
+    'message_count': 1234567,
+}
+
+
+def _items(data, monkeypatch, chunk_size, indent=None):
+    # the pure Python parser, whatever is installed
+    monkeypatch.setattr(json_stream, 'ijson', None)
+    monkeypatch.setattr(json_stream, 'CHUNK_SIZE', chunk_size)
+    f = io.BytesIO(json.dumps(data, indent=indent).encode('utf-8'))
+    return list(json_stream.iter_message_file(f, stream=True))
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_stream_matches_load_for_every_chunk_size(monkeypatch, indent):
+    expected = list(json_stream._iter_loaded(MESSAGE_FILE))
+    for chunk_size in range(1, 65):
+        assert _items(MESSAGE_FILE, monkeypatch, chunk_size, indent) == expected, chunk_size
+
+
+@pytest.mark.parametrize('data', [
+    {},
+    {'messages': []},
+    {'title': 'only a title'},
+    {'messages': [{'timestamp_ms': 10}], 'title': ''},
+])
+def test_stream_edge_cases(monkeypatch, data):
+    for chunk_size in [1, 2, 3, 64]:
+        assert _items(data, monkeypatch, chunk_size) == list(json_stream._iter_loaded(data))
+
+
+def test_number_split_across_chunks(monkeypatch):
+    # a top level number is decoded on its own, so '12' followed by '34' in
+    # the next chunk must not be read as 12 (nor 1. and 5 as 1)
+    data = {'count': 1234, 'ratio': 1.5, 'messages': [], 'last': -99}
+    for chunk_size in range(1, 40):
+        assert _items(data, monkeypatch, chunk_size) == list(json_stream._iter_loaded(data)), chunk_size
+
+
+def test_fields_are_filtered(monkeypatch):
+    monkeypatch.setattr(json_stream, 'ijson', None)
+    f = io.BytesIO(json.dumps(MESSAGE_FILE).encode('utf-8'))
+    messages = [value for key, value in json_stream.iter_message_file(
+        f, fields=['timestamp_ms'], stream=True) if key == 'messages']
+    assert messages == [{'timestamp_ms': 1434844397694}, {'timestamp_ms': 1},
+                        {'timestamp_ms': 12345678901234}]
+
+
+def test_malformed_file_raises(monkeypatch):
+    monkeypatch.setattr(json_stream, 'ijson', None)
+    monkeypatch.setattr(json_stream, 'CHUNK_SIZE', 4)
+    for text in [b'[1, 2]', b'{"messages": [{"a": 1}', b'{"title": "x" "y"}']:
+        with pytest.raises(ValueError):
+            list(json_stream.iter_message_file(io.BytesIO(text), stream=True))
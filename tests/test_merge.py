@@ -0,0 +1,76 @@
+import numpy as np
+
+import ingest
+
+
+def _conversation(messages, participants):
+    builder = ingest.ConversationBuilder('chat_abc')
+    builder.add('participants', [{'name': name} for name in participants])
+    builder.add('title', 'Chat')
+    for message in messages:
+        builder.add('messages', message)
+    return builder.build()
+
+
+def _message(timestamp, sender, content, reactions=()):
+    return {'timestamp_ms': timestamp, 'sender_name': sender, 'content': content,
+            'reactions': [{'actor': actor, 'reaction': emoji} for actor, emoji in reactions]}
+
+
+def _messages(conversation):
+    # (timestamp, sender, char count) -> the sorted (actor, emoji) reactions
+    messages = {}
+    for i in range(len(conversation)):
+        key = (int(conversation.timestamps[i]), conversation.names[conversation.sender_ids[i]],
+               int(conversation.char_counts[i]))
+        assert key not in messages
+        messages[key] = sorted(
+            (conversation.names[conversation.react_actor[j]], conversation.emojis[conversation.react_emoji[j]])
+            for j in np.flatnonzero(conversation.react_message == i).tolist())
+    return messages
+
+
+def test_merge_keeps_each_message_once_with_the_reactions_of_the_kept_copy():
+    newer = _conversation([
+        _message(3000, 'Ann', 'ccc', [('Bob', '👍')]),
+        _message(2000, 'Bob', 'bb', [('Ann', '❤')]),
+    ], ['Ann', 'Bob'])
+    # an older export: a different order of names, a message deleted since,
+    # other reactions to a message both have and a different message sent by
+    # the same person at the same time as another
+    older = _conversation([
+        _message(3000, 'Ann', 'different', [('Cat', '😮')]),
+        _message(2000, 'Bob', 'bb', [('Bob', '😂'), ('Cat', '😂')]),
+        _message(1000, 'Cat', 'a', [('Bob', '😮')]),
+    ], ['Cat', 'Bob', 'Ann'])
+
+    merged = ingest.merge_conversations([newer, older])
+
+    assert _messages(merged) == {
+        (3000, 'Ann', 3): [('Bob', '👍')],
+        (3000, 'Ann', 9): [('Cat', '😮')],
+        (2000, 'Bob', 2): [('Ann', '❤')],
+        (1000, 'Cat', 1): [('Bob', '😮')],
+    }
+    assert (np.diff(merged.timestamps) <= 0).all()
+    assert merged.title == 'Chat'
+    assert sorted(merged.participants) == ['Ann', 'Bob', 'Cat']
+    assert sorted(merged.names) == ['Ann', 'Bob', 'Cat']
+    assert sorted(merged.emojis) == sorted(['👍', '❤', '😮', '😂'])
+
+
+def test_merge_of_identical_copies_is_a_single_copy():
+    messages = [_message(3000 - i, ['Ann', 'Bob'][i % 2], 'x' * i, [('Ann', '👍')] * (i % 3))
+                for i in range(20)]
+    conversation = _conversation(messages, ['Ann', 'Bob'])
+    merged = ingest.merge_conversations([conversation, _conversation(messages, ['Bob', 'Ann'])])
+    assert _messages(merged) == _messages(conversation)
+    assert len(merged.react_message) == len(conversation.react_message)
+
+
+def test_merge_of_disjoint_copies_keeps_everything():
+    newer = _conversation([_message(20, 'Ann', 'new', [('Bob', '👍')])], ['Ann', 'Bob'])
+    older = _conversation([_message(10, 'Bob', 'old', [('Ann', '😂')])], ['Ann', 'Bob'])
+    merged = ingest.merge_conversations([newer, older])
+    assert _messages(merged) == {(20, 'Ann', 3): [('Bob', '👍')], (10, 'Bob', 3): [('Ann', '😂')]}
+    assert merged.timestamps.tolist() == [20, 10]
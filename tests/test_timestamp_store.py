@@ -0,0 +1,128 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import timestamp_store
+
+
+def _store(folder):
+    return timestamp_store.TimestampStore(data_file=str(folder / 'timestamps.{}.i64'),
+                                          index_file=str(folder / 'timestamps.json'))
+
+
+def _read(store, conv, chunk_size=timestamp_store.CHUNK_SIZE):
+    return np.concatenate([np.zeros(0, dtype=np.int64)]
+                          + [np.array(chunk) for chunk in store.chunks(conv, chunk_size)]).tolist()
+
+
+def _data_files(folder):
+    return sorted(name for name in os.listdir(folder) if name.endswith('.i64'))
+
+
+def test_round_trip(tmp_path):
+    store = _store(tmp_path)
+    store.append('a', ['a', 1], np.arange(10))
+    store.append('b', ['b', 1], np.array([5, 7, 9]))
+    store.append('empty', ['e', 1], np.zeros(0, dtype=np.int64))
+    store.save()
+
+    store = _store(tmp_path)
+    for chunk_size in [1, 3, 64]:
+        assert _read(store, 'a', chunk_size) == list(range(10))
+    assert _read(store, 'b') == [5, 7, 9]
+    assert _read(store, 'empty') == []
+    assert store.span('b') == (3, 5, 9)
+    assert store.has('a', ['a', 1]) and not store.has('a', ['a', 2]) and not store.has('c', ['c', 1])
+
+
+def test_save_drops_conversations_not_kept(tmp_path):
+    store = _store(tmp_path)
+    store.append('a', 1, np.arange(3))
+    store.append('b', 1, np.arange(3))
+    store.save(keep={'b'})
+    store = _store(tmp_path)
+    assert not store.has('a', 1) and store.has('b', 1)
+
+
+def test_compaction_switches_generation(tmp_path):
+    store = _store(tmp_path)
+    store.append('a', 1, np.arange(100))
+    store.append('b', 1, np.arange(1000, 1010))
+    store.save()
+    assert _data_files(tmp_path) == ['timestamps.0.i64']
+
+    # most of the data file is no longer indexed once a is replaced twice
+    store = _store(tmp_path)
+    store.append('a', 2, np.arange(200, 300))
+    store.append('a', 3, np.arange(300, 310))
+    store.save()
+    assert _data_files(tmp_path) == ['timestamps.1.i64']
+    assert os.path.getsize(tmp_path / 'timestamps.1.i64') == 20 * timestamp_store.ITEM_SIZE
+
+    store = _store(tmp_path)
+    assert _read(store, 'a') == list(range(300, 310))
+    assert _read(store, 'b') == list(range(1000, 1010))
+
+
+def test_crash_before_the_index_is_written_keeps_the_previous_store(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    store.append('a', 1, np.arange(100))
+    store.append('b', 1, np.arange(1000, 1010))
+    store.save()
+
+    store = _store(tmp_path)
+    store.append('a', 2, np.arange(200, 300))
+    store.append('a', 3, np.arange(300, 310))
+
+    def crash(*args, **kwargs):
+        raise OSError('crash')
+
+    # the data is compacted into the next generation, but the index naming it
+    # is never written
+    monkeypatch.setattr(json, 'dump', crash)
+    with pytest.raises(OSError):
+        store.save()
+    monkeypatch.undo()
+
+    store = _store(tmp_path)
+    assert store.has('a', 1) and store.has('b', 1)
+    assert _read(store, 'a') == list(range(100))
+    assert _read(store, 'b') == list(range(1000, 1010))
+
+    # the next save compacts again and removes the leftovers
+    store.append('c', 1, np.arange(5))
+    store.save()
+    store = _store(tmp_path)
+    assert len(_data_files(tmp_path)) == 1
+    assert _read(store, 'a') == list(range(100))
+    assert _read(store, 'b') == list(range(1000, 1010))
+    assert _read(store, 'c') == list(range(5))
+
+
+def test_appends_without_a_save_are_ignored(tmp_path):
+    store = _store(tmp_path)
+    store.append('a', 1, np.arange(10))
+    store.save()
+
+    store = _store(tmp_path)
+    store.append('a', 2, np.arange(50, 60))
+    store._append.close()  # the run crashes before saving
+
+    store = _store(tmp_path)
+    assert store.has('a', 1)
+    assert _read(store, 'a') == list(range(10))
+
+
+def test_index_of_an_older_version_is_ignored(tmp_path):
+    with open(tmp_path / 'timestamps.json', 'w') as f:
+        json.dump({'a': [0, 3, 0, 2, 1]}, f)
+    np.arange(3, dtype='<i8').tofile(str(tmp_path / 'timestamps.i64'))
+    store = _store(tmp_path)
+    assert not store.has('a', 1)
+
+    store.append('b', 1, np.arange(4))
+    store.save()
+    assert _data_files(tmp_path) == ['timestamps.0.i64']
+    assert _read(_store(tmp_path), 'b') == list(range(4))
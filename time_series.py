@@ -1,66 +1,137 @@
-from datetime import datetime
-import json
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-import messenger_stats as main
-import utils
-
-def run(messages_folder):
-    for conv in utils.get_conversations(messages_folder):
-        message_id = 1
-        timestamps = []
-        while True:
-            try:
-                file_name = main.MESSAGE_FILE.format(message_id)
-                with open(os.path.join(messages_folder, conv, file_name)) as f:
-                    data = json.load(f)
-                timestamps.extend([message['timestamp_ms'] for message in data['messages']])
-                message_id += 1
-            except FileNotFoundError:
-                break
-        timestamps.sort()
-
-        # skip the first few messages in case there are the 'messenger introduction' messages
-        # that occur when people initially friend/connect with each other
-        if len(timestamps) >= 3:
-            timestamps = timestamps[2:]
-
-        if len(timestamps) < main.MIN_MESSAGE_COUNT:
-            continue
+import config
+import output
+import timeline
+import timestamp_store
+
+PER_CONVERSATION = True  # outputs are written per conversation (see messenger_stats.main)
+SPILL_TIMESTAMPS = True  # the timestamps are moved to the timestamp store (see ingest.aggregate_conversations)
+RESOLUTIONS = ['month']  # the resolutions to plot by default (see timeline.RESOLUTIONS)
+ROLLING_WINDOW = 30  # the number of days the message rate is averaged over
+
+def aggregate(conversation):
+    """Returns the sorted message timestamps of a conversation, the number
+    of them which are skipped and its daily message counts (see
+    timeline.Timeline), or None if the conversation is too small to analyze.
+    Only the sampled timestamps of a sampled conversation are kept, and its
+    counts are estimates. The timestamps are usually moved to the timestamp
+    store before the aggregate is used (see timestamp_store.aggregate_chunks).
+
+    Args:
+        conversation (ingest.Conversation): the conversation to analyze.
+    """
+    timestamps = np.sort(conversation.timestamps)
+
+    # skip the first few messages in case there are the 'messenger introduction' messages
+    # that occur when people initially friend/connect with each other
+    skip = 2 if len(timestamps) >= 3 else 0
+
+    if conversation.scaled(len(timestamps) - skip) < config.MIN_MESSAGE_COUNT:
+        return None
+    return {
+        'name': conversation.name,
+        'timestamps': timestamps,
+        'skip': skip,
+        'timeline': timeline.Timeline(timestamps[skip:], conversation.scale),
+    }
+
+
+def _lines(result):
+    # the lines of a conversation's data file, a chunk of timestamps at a time
+    skip = result['skip']
+    for timestamps in timestamp_store.aggregate_chunks(result):
+        if skip:
+            timestamps, skip = timestamps[skip:], max(0, skip - len(timestamps))
+        yield ''.join(str(time) + '\n' for time in timestamps.tolist())
 
-        utils.prepare_output_directory(os.path.join('output', 'time_series', conv))
+
+def run(results, write_data=True, resolutions=RESOLUTIONS):
+    """Writes the timestamps of each conversation and returns the plot specs
+    (see plots.render).
+
+    Args:
+        results (list of dict): the aggregate of every conversation.
+        write_data (bool, optional): whether to write the data files.
+        resolutions (list of str, optional): the resolutions to plot the
+            number of messages at (see timeline.RESOLUTIONS).
+    """
+    specs = []
+    for result in results:
+        if result is None:
+            continue
+        conv = result['name']
+        messages = result['timeline']
 
         # Create data files
-        with open(os.path.join('output', 'time_series', conv, 'data.tsv'), 'w') as f:
-            for time in timestamps:
-                f.write(str(time) + '\n')
+        if write_data:
+            output.writer.claim(os.path.join('output', 'time_series', conv), output.DATA_SUFFIXES)
+            output.writer.write(os.path.join('output', 'time_series', conv, 'data.tsv'),
+                                ''.join(_lines(result)))
 
         # Create plots
-        first_time = timestamps[0]
-        last_time = timestamps[-1]
-        num_months = (int) ((last_time - first_time) / (30 * utils.MILLISECONDS_PER_DAY) + 1)
-        y, bin_edges = np.histogram(timestamps, bins=num_months * 2)
-        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2.0
-        timestamps = [datetime.utcfromtimestamp(time / 1000) for time in bin_centers]
-        plt.figure(figsize=(14, 6.5))
-        plt.plot(timestamps, y)
-        plt.title('Messages Rate Over Time')
-        plt.xlabel('Date')
-        plt.ylabel('Messages per Interval (roughly half month)')
-        plt.savefig(os.path.join('output', 'time_series', conv, 'messages_rate_over_time.png'), bbox_inches='tight')
-        plt.close()
-
-        accumulated = []
-        total = 0
-        for bin_count in y:
-            total += bin_count
-            accumulated.append(total)
-        plt.figure(figsize=(14, 6.5))
-        plt.plot(timestamps, accumulated)
-        plt.title('Total Messages over Time')
-        plt.xlabel('Date')
-        plt.ylabel('Message Count')
-        plt.savefig(os.path.join('output', 'time_series', conv, 'total_messages_over_time.png'), bbox_inches='tight')
-        plt.close()
+        for resolution in resolutions:
+            starts, counts = messages.resample(resolution)
+            specs.append({
+                'kind': 'line',
+                'path': os.path.join('output', 'time_series', conv,
+                                     'messages_per_{}.png'.format(resolution)),
+                'x': starts,
+                'y': counts,
+                'title': 'Messages per {}'.format(resolution.title()),
+                'xlabel': 'Date',
+                'ylabel': 'Message Count',
+            })
+        specs.append({
+            'kind': 'line',
+            'path': os.path.join('output', 'time_series', conv, 'messages_rate_over_time.png'),
+            'x': messages.days(),
+            'y': messages.rolling_mean(ROLLING_WINDOW),
+            'title': 'Messages Rate Over Time',
+            'xlabel': 'Date',
+            'ylabel': 'Messages per Day ({} day average)'.format(ROLLING_WINDOW),
+        })
+        specs.append({
+            'kind': 'line',
+            'path': os.path.join('output', 'time_series', conv, 'total_messages_over_time.png'),
+            'x': messages.days(),
+            'y': messages.cumulative(),
+            'title': 'Total Messages over Time',
+            'xlabel': 'Date',
+            'ylabel': 'Message Count',
+        })
+        specs.append({
+            'kind': 'heatmap',
+            'path': os.path.join('output', 'time_series', conv, 'messages_by_hour.png'),
+            'x': list(range(24)),
+            'y': timeline.WEEKDAYS,
+            'z': messages.weekday_hour,
+            'title': 'Messages by Hour (UTC)',
+            'xlabel': 'Hour',
+        })
+    return specs
+
+
+def tables(results, resolutions=RESOLUTIONS):
+    """Returns the number of messages of every conversation at each
+    resolution, and by hour of the week, as tables (see export.export_tables).
+    """
+    series = {'conversation': [], 'resolution': [], 'start': [], 'count': [], 'total': []}
+    hours = {'conversation': [], 'weekday': [], 'hour': [], 'count': []}
+    for result in results:
+        if result is None:
+            continue
+        for resolution in resolutions:
+            starts, counts = result['timeline'].resample(resolution)
+            series['conversation'].extend([result['name']] * len(starts))
+            series['resolution'].extend([resolution] * len(starts))
+            series['start'].extend(starts.astype('datetime64[ms]').astype(np.int64).tolist())
+            series['count'].extend(counts.tolist())
+            series['total'].extend(np.cumsum(counts).tolist())
+        hours['conversation'].extend([result['name']] * 7 * 24)
+        hours['weekday'].extend(np.repeat(timeline.WEEKDAYS, 24).tolist())
+        hours['hour'].extend(list(range(24)) * 7)
+        hours['count'].extend(result['timeline'].weekday_hour.ravel().tolist())
+    return {'time_series': series, 'time_series_by_hour': hours}
+
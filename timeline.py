@@ -0,0 +1,104 @@
+import numpy as np
+
+import utils
+
+MILLISECONDS_PER_HOUR = 3600000
+RESOLUTIONS = ['day', 'week', 'month', 'year']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+class Timeline:
+    """The number of messages sent each (UTC) day of a conversation, and their
+    prefix sums. The timestamps are only scanned once, after which the count
+    of any range of days is a single subtraction, so series at any resolution,
+    window or rolling average only cost O(1) per point.
+
+    Attributes:
+        first_day (int): the day of the first message, in days since the
+            epoch.
+        counts (int64 array): the number of messages of each day, starting at
+            first_day.
+        prefix (int64 array): prefix[i] is the number of messages before day
+            first_day + i, so it has one more entry than counts.
+        weekday_hour (int64 array): the (7 x 24) number of messages sent in
+            each hour of each day of the week, Monday first.
+    """
+
+    def __init__(self, timestamps, scale=1.0):
+        """
+        Args:
+            timestamps (int64 array): the time (in ms) each message was sent,
+                in any order.
+            scale (float, optional): the number of messages each timestamp
+                stands for, if they are a sample (see
+                ingest.sample_conversation).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        days = timestamps // utils.MILLISECONDS_PER_DAY
+        self.first_day = int(days.min()) if len(days) else 0
+        self.counts = np.bincount(days - self.first_day) if len(days) else np.zeros(0, dtype=np.int64)
+        # the epoch was a Thursday
+        hours = (timestamps // MILLISECONDS_PER_HOUR) % 24
+        self.weekday_hour = np.bincount((days + 3) % 7 * 24 + hours, minlength=7 * 24).reshape(7, 24)
+        if scale != 1:
+            self.counts = np.rint(self.counts * scale).astype(np.int64)
+            self.weekday_hour = np.rint(self.weekday_hour * scale).astype(np.int64)
+        self.prefix = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __len__(self):
+        return len(self.counts)
+
+    def count(self, begin, end):
+        """Returns the number of messages sent in [begin, end), where both are
+        days since the epoch and may be outside of the timeline.
+        """
+        begin, end = np.clip([begin - self.first_day, end - self.first_day], 0, len(self))
+        return int(self.prefix[end] - self.prefix[begin])
+
+    def days(self):
+        """Returns each day of the timeline as a datetime64[D] array."""
+        return np.arange(self.first_day, self.first_day + len(self)).astype('datetime64[D]')
+
+    def resample(self, resolution):
+        """Returns the number of messages sent in each calendar day, week
+        (starting on Monday), month or year of the timeline.
+
+        Args:
+            resolution (str): one of RESOLUTIONS.
+
+        Returns:
+            the start of each period as a datetime64[D] array, and the number
+            of messages of each period.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype='datetime64[D]'), np.zeros(0, dtype=np.int64)
+        first = np.datetime64(self.first_day, 'D')
+        last = np.datetime64(self.first_day + len(self) - 1, 'D')
+        if resolution == 'day':
+            starts = np.arange(first, last + 1)
+        elif resolution == 'week':
+            monday = first - (self.first_day + 3) % 7
+            starts = np.arange(monday, last + 1, 7)
+        elif resolution in ('month', 'year'):
+            unit = 'M' if resolution == 'month' else 'Y'
+            starts = np.arange(first.astype('datetime64[' + unit + ']'),
+                               last.astype('datetime64[' + unit + ']') + 1).astype('datetime64[D]')
+        else:
+            raise ValueError('unknown resolution: ' + resolution)
+        bounds = np.append(starts, last + 1).astype(np.int64) - self.first_day
+        bounds = np.clip(bounds, 0, len(self))
+        return starts, self.prefix[bounds[1:]] - self.prefix[bounds[:-1]]
+
+    def rolling_mean(self, window):
+        """Returns the mean number of messages per day over the window days
+        up to and including each day of the timeline.
+        """
+        end = np.arange(1, len(self) + 1)
+        begin = np.maximum(end - window, 0)
+        return (self.prefix[end] - self.prefix[begin]) / window
+
+    def cumulative(self):
+        """Returns the total number of messages sent up to and including each
+        day of the timeline.
+        """
+        return self.prefix[1:]
@@ -0,0 +1,182 @@
+import json
+import numpy as np
+import os
+
+import config
+
+DATA_FILE = os.path.join(config.CACHE_FOLDER, 'timestamps.{}.i64')  # formatted with the generation
+INDEX_FILE = os.path.join(config.CACHE_FOLDER, 'timestamps.json')
+VERSION = 1  # bump whenever what is stored changes, e.g. the order of the timestamps
+CHUNK_SIZE = 1 << 20  # the most timestamps mapped into memory at a time
+ITEM_SIZE = np.dtype(np.int64).itemsize
+
+
+class TimestampStore:
+    """The sorted message timestamps of every conversation, appended to a
+    single file of little-endian int64s, with an index of each conversation's
+    offset and length in it. The file is only ever read through short-lived memory
+    maps of at most CHUNK_SIZE timestamps (see chunks), so reading it never
+    holds more than a chunk in memory however large the inbox is, and any
+    number of processes can map the same file read-only without copying it.
+
+    A conversation is appended again whenever its key changes, leaving its
+    old timestamps behind until the file is compacted (see save). Compacting
+    copies the live timestamps to a data file of the next generation, which
+    only replaces the current one once the index naming it is written, so a
+    crash at any point leaves the index and its data file consistent.
+    """
+
+    def __init__(self, data_file=DATA_FILE, index_file=INDEX_FILE):
+        self.data_file_format = data_file
+        self.index_file = index_file
+        self._index = None  # conversation -> [offset, count, first, last, key]
+        self._generation = 0  # the generation of the current data file
+        self._append = None  # the data file, while it is being appended to
+        self._end = 0  # the number of timestamps in the data file
+
+    @property
+    def data_file(self):
+        """The path to the current data file."""
+        return self.data_file_format.format(self._generation)
+
+    def _load(self):
+        if self._index is not None:
+            return self._index
+        self._index = {}
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return self._index
+        # the index of an older version is ignored, along with its data
+        if not isinstance(index, dict) or index.get('version') != VERSION:
+            return self._index
+        self._generation = index['generation']
+        try:
+            self._end = os.path.getsize(self.data_file) // ITEM_SIZE
+        except FileNotFoundError:
+            return self._index
+        index = index['conversations']
+        # spans past the end of the data file were never fully written
+        self._index = {conv: entry for conv, entry in index.items()
+                       if entry[0] + entry[1] <= self._end}
+        return self._index
+
+    def has(self, conv, key):
+        """Returns whether the store has a conversation's timestamps as of the
+        key (e.g. its location and fingerprint).
+        """
+        entry = self._load().get(conv)
+        return entry is not None and entry[4] == key
+
+    def append(self, conv, key, timestamps):
+        """Stores a conversation's timestamps, replacing any previous ones."""
+        self._load()
+        if self._append is None:
+            os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+            self._append = open(self.data_file, 'ab')
+            self._end = self._append.tell() // ITEM_SIZE
+        timestamps = np.asarray(timestamps, dtype='<i8')
+        self._append.write(timestamps.tobytes())
+        first, last = (int(timestamps.min()), int(timestamps.max())) if len(timestamps) else (0, 0)
+        self._index[conv] = [self._end, len(timestamps), first, last, key]
+        self._end += len(timestamps)
+
+    def span(self, conv):
+        """Returns the number of timestamps of a conversation and the earliest
+        and latest of them, without reading any.
+        """
+        offset, count, first, last, _ = self._load()[conv]
+        return count, first, last
+
+    def chunks(self, conv, chunk_size=CHUNK_SIZE):
+        """Yields a conversation's timestamps as read-only arrays of at most
+        chunk_size, each mapped from the data file only until the next is
+        requested.
+        """
+        offset, count, _, _, _ = self._load()[conv]
+        if self._append is not None:
+            self._append.flush()
+        for begin in range(0, count, chunk_size):
+            yield np.memmap(self.data_file, dtype='<i8', mode='r', offset=(offset + begin) * ITEM_SIZE,
+                            shape=(min(chunk_size, count - begin),))
+
+    def save(self, keep=None):
+        """Writes the index, first compacting the data file if most of it is
+        no longer indexed, then removes the data files it no longer names.
+
+        Args:
+            keep (collection of str, optional): if given, the conversations to
+                keep, dropping every other one.
+        """
+        index = self._load()
+        if self._append is not None:
+            self._append.close()
+            self._append = None
+        if keep is not None:
+            for conv in [conv for conv in index if conv not in keep]:
+                del index[conv]
+        live = sum(entry[1] for entry in index.values())
+        if self._end > 2 * live:
+            self._compact()
+        if index or os.path.exists(self.index_file):
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            with open(self.index_file + '.tmp', 'w') as f:
+                json.dump({'version': VERSION, 'generation': self._generation, 'conversations': index}, f)
+            os.replace(self.index_file + '.tmp', self.index_file)
+            self._remove_stale()
+
+    def _compact(self):
+        # copies the indexed timestamps to the data file of the next
+        # generation a chunk at a time. The current data file is left as it is
+        # for the index on disk until the new index replaces it.
+        end = 0
+        offsets = {}
+        with open(self.data_file_format.format(self._generation + 1), 'wb') as f:
+            for conv, entry in self._index.items():
+                for chunk in self.chunks(conv):
+                    f.write(chunk.tobytes())
+                offsets[conv] = end
+                end += entry[1]
+        for conv, offset in offsets.items():
+            self._index[conv][0] = offset
+        self._generation += 1
+        self._end = end
+
+    def _remove_stale(self):
+        # removes the data files of every other generation, i.e. those
+        # replaced by a compaction and those of a compaction that crashed
+        folder = os.path.dirname(self.data_file_format)
+        prefix, suffix = os.path.basename(self.data_file_format).split('{}')
+        current = os.path.basename(self.data_file)
+        for entry in os.scandir(folder or '.'):
+            if (entry.name.startswith(prefix) and entry.name.endswith(suffix)
+                    and entry.name != current):
+                os.remove(entry.path)
+
+
+store = TimestampStore()  # the store of this process
+
+
+def aggregate_chunks(aggregate):
+    """Yields the sorted timestamps of an analysis' aggregate a chunk at a
+    time: its own if it still has them (e.g. a sampled conversation's), or
+    else those of its conversation in the store (see
+    ingest.aggregate_conversations).
+    """
+    if 'timestamps' in aggregate:
+        yield aggregate['timestamps']
+    else:
+        yield from store.chunks(aggregate['name'])
+
+
+def aggregate_span(aggregate):
+    """Returns the number of timestamps of an analysis' aggregate and the
+    earliest and latest of them (see aggregate_chunks).
+    """
+    if 'timestamps' not in aggregate:
+        return store.span(aggregate['name'])
+    timestamps = aggregate['timestamps']
+    if len(timestamps) == 0:
+        return 0, 0, 0
+    return len(timestamps), int(timestamps.min()), int(timestamps.max())
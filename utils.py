@@ -1,33 +1,59 @@
 from datetime import datetime
+import functools
 import numpy as np
-import os
-import shutil
+import re
+import unicodedata
 
-import messenger_stats as main
+import sources
 
 ENDTIME = datetime.max.timestamp() * 1000  # arbitrarily the large time (in ms)
 MILLISECONDS_PER_DAY = 86400000
 
+# the reacts with a description, in the order their counts are written out
+# (before those of any other emoji, see unicode_to_react)
+REACTS = ['Thumbs Up', 'Thumbs Down', 'Laughing', 'Heart Eyes', 'Angry', 'Cry', 'Wow']
+_EMOJI_TO_REACT = {
+    u'\U0001f44d': 'Thumbs Up',
+    u'\U0001f44e': 'Thumbs Down',
+    u'\U0001f606': 'Laughing',
+    u'\U0001f60d': 'Heart Eyes',
+    u'\U0001f620': 'Angry',
+    u'\U0001f622': 'Cry',
+    u'\U0001f62e': 'Wow',
+}
+# characters which only modify how the emoji before them is displayed
+_EMOJI_MODIFIERS = {u'\ufe0f', u'\u200d'} | {chr(c) for c in range(0x1f3fb, 0x1f400)}
 
-# TODO: expose this filtering capability to user
-def get_conversations(root_dir, filters=[]):
+
+def get_conversations(source, filters=[]):
     """Returns a list of the available conversations, corresponding to the
     folders' names.
 
     Args:
-        root_dir (str): the path name to the folder containing the conversation
-            folders (e.g. messages/inbox).
+        source (str or sources.FolderSource or sources.ZipSource): the source
+            of the messages, or the path name to the folder containing the
+            conversation folders (e.g. messages/inbox).
         filters (list of str, optional): a list of strings that all must be
             substrings of a conversation folder's name.
     
     Returns:
         the filtered list of conversation folder names.
     """
-    conversations = os.listdir(root_dir)
+    if isinstance(source, str):
+        source = sources.FolderSource(source)
+    return filter_conversations(source.list_conversations(), filters)
+
+
+def filter_conversations(conversations, filters=[]):
+    """Returns the conversations whose folder names contain all of the filters
+    (case insensitive), in the same order.
+
+    Args:
+        conversations (list of str): the conversation folder names.
+        filters (list of str, optional): see get_conversations.
+    """
     filtered = []
     for conv in conversations:
-        if not os.path.isfile(os.path.join(root_dir, conv, main.MESSAGE_FILE.format(1))):
-            continue
         include = True
         for f in filters:
             if f.lower() not in conv.lower():
@@ -38,39 +64,70 @@ def get_conversations(root_dir, filters=[]):
     return filtered
 
 
+def decode_text(s):
+    """Repairs a string of Facebook's export, which writes the UTF-8 bytes of
+    every string as if they were latin-1 characters (e.g. u'\\xc3\\xa9' for
+    u'\\xe9'). Strings which are not mangled are returned unchanged.
+
+    Args:
+        s (str): the string as it appears in the message files.
+
+    Returns:
+        the repaired string.
+    """
+    try:
+        return s.encode('latin-1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return s
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def decode(s):
+    """Like decode_text, but remembers the strings it repaired. Use it for
+    names, titles and reactions, which repeat throughout the messages.
+    """
+    return decode_text(s)
+
+
+@functools.lru_cache(maxsize=None)
 def unicode_to_react(c):
-    """Returns a string description of select unicode emoji characters.
+    """Returns a string description of a (decoded) emoji.
 
     Args:
         c (str): the emoji to obtain a name of.
     
     Returns:
-        an English description of the emoji character.
+        an English description of the emoji character, e.g. 'Thumbs Up', or
+        'OTHER' if it is not an emoji.
     """
-    if c == u'\xf0\x9f\x91\x8d':
-        return 'Thumbs Up'
-    if c == u'\xf0\x9f\x91\x8e':
-        return 'Thumbs Down'
-    if c == u'\xf0\x9f\x98\x86':
-        return 'Laughing'
-    if c == u'\xf0\x9f\x98\x8d':
-        return 'Heart Eyes'
-    if c == u'\xf0\x9f\x98\xa0':
-        return 'Angry'
-    if c == u'\xf0\x9f\x98\xa2':
-        return 'Cry'
-    if c == u'\xf0\x9f\x98\xae':
-        return 'Wow'
-    return 'OTHER'
-
-
-def subcategorybar(plt, X, vals, width=0.8):
+    c = _strip_modifiers(c)
+    if c in _EMOJI_TO_REACT:
+        return _EMOJI_TO_REACT[c]
+    if not c or any(unicodedata.category(char) != 'So' for char in c):
+        return 'OTHER'
+    names = [unicodedata.name(char, '') for char in c]
+    return ' '.join(names).title()
+
+
+def react_column(react):
+    """Returns the name of the data column of a react's counts, e.g.
+    'thumbs_up' for 'Thumbs Up'.
+    """
+    return re.sub(r'\W+', '_', react.lower())
+
+
+def _strip_modifiers(c):
+    # e.g. a skin tone still counts as the same react
+    return ''.join(char for char in c if char not in _EMOJI_MODIFIERS)
+
+
+def subcategorybar(ax, X, vals, width=0.8):
     """Creates a bar graph with multiple bars per categorical variable.
     Inspired from
     https://stackoverflow.com/questions/48157735/plot-multiple-bars-for-categorical-data
 
     Args:
-        plt (matplotlib.pyplot): a handle to the plotting object.
+        ax (matplotlib.axes.Axes): the axes to plot on.
         X (list of str): the list of categories which contain subcategories.
         vals (list of list of num): the values to plot. The outer list
             corresponds to the subcategory values and the inner list
@@ -80,17 +137,7 @@ def subcategorybar(plt, X, vals, width=0.8):
     n = len(vals)
     _X = np.arange(len(X))
     for i in range(n):
-        plt.bar(_X - width/2.0 + i/float(n)*width, vals[i], width=width/float(n), align='edge')   
-    plt.xticks(_X, X)
-
+        ax.bar(_X - width/2.0 + i/float(n)*width, vals[i], width=width/float(n), align='edge')
+    ax.set_xticks(_X)
+    ax.set_xticklabels(X)
 
-def prepare_output_directory(path):
-    """Creates a directory at path, deleting the existing directory at the path
-    if it exists.
-
-    Args:
-        path (str): the path to the target directory.
-    """
-    if os.path.isdir(path):
-        shutil.rmtree(path)
-    os.makedirs(path)
@@ -0,0 +1,262 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import json
+import os
+import re
+import shutil
+import sqlite3
+
+import config
+import ingest
+import json_stream
+from profiling import profiler
+import sources
+import utils
+
+INDEX_FILE = os.path.join(config.CACHE_FOLDER, 'word_index.sqlite')
+INDEX_VERSION = 1  # bump whenever the schema or tokenization changes
+SPILL_FOLDER = os.path.join(config.CACHE_FOLDER, 'word_index_spill')
+BATCH_SIZE = 10000  # the number of postings inserted at a time
+
+_TOKEN = re.compile(r"\w+(?:['’]\w+)*")
+
+# Every (term, conversation, person, month) count is stored once, so that
+# the counts per person, per conversation or over time are all a single
+# grouped query over one term's (or person's) postings.
+SCHEMA = '''
+CREATE TABLE conversations (id INTEGER PRIMARY KEY, name TEXT UNIQUE, title TEXT, fingerprint TEXT);
+CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE);
+CREATE TABLE postings (
+    term_id INTEGER, conversation_id INTEGER, person_id INTEGER, month INTEGER, count INTEGER,
+    PRIMARY KEY (term_id, conversation_id, person_id, month)
+) WITHOUT ROWID;
+CREATE INDEX postings_person ON postings (person_id, term_id);
+CREATE INDEX postings_conversation ON postings (conversation_id);
+'''
+
+
+def tokenize(content):
+    """Returns the lowercase words of a message's (decoded) content."""
+    return _TOKEN.findall(content.lower())
+
+
+def connect(path=INDEX_FILE):
+    """Opens the index, creating it (or recreating it if it was built by an
+    incompatible version) if necessary.
+
+    Returns:
+        the sqlite3 connection.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    if db.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+        db.close()
+        os.remove(path)
+        db = sqlite3.connect(path)
+        db.executescript(SCHEMA)
+        db.execute('PRAGMA user_version = {}'.format(INDEX_VERSION))
+    return db
+
+
+def _tokenize_conversation(source, conv, stream):
+    """Counts the words each person sent each month in a conversation, and
+    spills the counts to a file so that only one conversation's counts are
+    ever held in memory.
+
+    Returns:
+        the conversation's decoded title and the path to the spill file.
+    """
+    counts = {}  # (term, person, month) -> count
+    months = {}  # day -> month, since converting timestamps is slow
+    title = None
+    exports = source.exports(conv) if isinstance(source, sources.MergedSource) else [source]
+    seen = set()  # the messages already counted, if merging exports (see ingest.merge_conversations)
+    for export in exports:
+        message_id = 1
+        while True:
+            try:
+                f = export.open(conv, config.MESSAGE_FILE.format(message_id))
+            except FileNotFoundError:
+                break
+            with f:
+                fields = ['timestamp_ms', 'sender_name', 'content']
+                for key, value in json_stream.iter_message_file(f, fields, stream):
+                    if key == 'title' and title is None:
+                        title = utils.decode(value)
+                    if key != 'messages' or 'content' not in value:
+                        continue
+                    if len(exports) > 1:
+                        message = (value['timestamp_ms'], value['sender_name'],
+                                   ingest.content_hash(value['content']))
+                        if message in seen:
+                            continue
+                        seen.add(message)
+                    day = value['timestamp_ms'] // 86400000
+                    if day not in months:
+                        date = datetime.utcfromtimestamp(day * 86400)
+                        months[day] = date.year * 100 + date.month
+                    month = months[day]
+                    person = value['sender_name']
+                    for term in tokenize(utils.decode_text(value['content'])):
+                        entry = (term, person, month)
+                        counts[entry] = counts.get(entry, 0) + 1
+            message_id += 1
+
+    path = os.path.join(SPILL_FOLDER, str(os.getpid()) + '_' + conv + '.json')
+    with open(path, 'w') as f:
+        for (term, person, month), count in counts.items():
+            f.write(json.dumps([term, utils.decode(person), month, count]) + '\n')
+    return title or conv, path
+
+
+def build(source, fingerprints, stream=False, jobs=1, rebuild=False):
+    """Updates the index with every conversation whose message files changed
+    since it was indexed, and removes the conversations that no longer exist.
+    Conversations are tokenized in a pool of worker processes if jobs > 1, and
+    their counts inserted as each one is done.
+
+    Args:
+        source (sources.FolderSource or sources.ZipSource): the source of the
+            messages.
+        fingerprints (dict): conversation name -> fingerprint (see
+            sources.FolderSource.fingerprint) of every conversation to index.
+        stream (bool, optional): see json_stream.iter_message_file.
+        jobs (int, optional): the number of worker processes to use.
+        rebuild (bool, optional): whether to reindex every conversation.
+
+    Returns:
+        the number of conversations that were (re)indexed.
+    """
+    db = connect()
+    indexed = {name: (conversation_id, fingerprint) for conversation_id, name, fingerprint
+               in db.execute('SELECT id, name, fingerprint FROM conversations')}
+    stale = [conv for conv in indexed
+             if rebuild or conv not in fingerprints
+             or json.loads(indexed[conv][1]) != fingerprints[conv]]
+    for conv in stale:
+        db.execute('DELETE FROM postings WHERE conversation_id = ?', (indexed[conv][0],))
+        db.execute('DELETE FROM conversations WHERE id = ?', (indexed[conv][0],))
+    convs = [conv for conv in fingerprints if conv not in indexed or conv in stale]
+
+    os.makedirs(SPILL_FOLDER, exist_ok=True)
+    try:
+        with profiler.stage('word_index', 'tokenize'):
+            args = [[source] * len(convs), convs, [stream] * len(convs)]
+            if jobs > 1 and len(convs) > 1:
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    _insert(db, fingerprints, convs, executor.map(
+                        _tokenize_conversation, *args, chunksize=max(1, len(convs) // (jobs * 4))))
+            else:
+                _insert(db, fingerprints, convs, map(_tokenize_conversation, *args))
+        db.commit()
+    finally:
+        db.close()
+        shutil.rmtree(SPILL_FOLDER, ignore_errors=True)
+    return len(convs)
+
+
+def _insert(db, fingerprints, convs, spills):
+    # inserts the counts of each conversation as soon as it is tokenized
+    term_ids = dict(db.execute('SELECT term, id FROM terms'))
+    person_ids = dict(db.execute('SELECT name, id FROM people'))
+
+    def intern(table, column, ids, value):
+        if value not in ids:
+            ids[value] = db.execute(
+                'INSERT INTO {} ({}) VALUES (?)'.format(table, column), (value,)).lastrowid
+        return ids[value]
+
+    for conv, (title, path) in zip(convs, spills):
+        conversation_id = db.execute(
+            'INSERT INTO conversations (name, title, fingerprint) VALUES (?, ?, ?)',
+            (conv, title, json.dumps(fingerprints[conv]))).lastrowid
+        batch = []
+        with open(path) as f:
+            for line in f:
+                term, person, month, count = json.loads(line)
+                batch.append((intern('terms', 'term', term_ids, term), conversation_id,
+                              intern('people', 'name', person_ids, person), month, count))
+                if len(batch) == BATCH_SIZE:
+                    db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?)', batch)
+                    batch = []
+        db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?)', batch)
+        os.remove(path)
+
+
+def top_terms(db, person=None, conversation=None, n=20):
+    """Returns the n most used terms and their counts, optionally only those
+    sent by one person and/or in one conversation (folder name).
+    """
+    conditions, params = _filters(person=person, conversation=conversation)
+    return db.execute(
+        'SELECT term, SUM(count) AS total FROM postings JOIN terms ON terms.id = term_id'
+        + conditions + ' GROUP BY term_id ORDER BY total DESC, term LIMIT ?',
+        params + [n]).fetchall()
+
+
+def top_people(db, term, conversation=None, n=20):
+    """Returns the n people who used a term the most and their counts,
+    optionally only in one conversation (folder name).
+    """
+    conditions, params = _filters(term=term, conversation=conversation)
+    return db.execute(
+        'SELECT name, SUM(count) AS total FROM postings JOIN people ON people.id = person_id'
+        + conditions + ' GROUP BY person_id ORDER BY total DESC, name LIMIT ?',
+        params + [n]).fetchall()
+
+
+def term_over_time(db, term, person=None, conversation=None):
+    """Returns the number of times a term was used each month, as a list of
+    (YYYY-MM, count) pairs in chronological order.
+    """
+    conditions, params = _filters(term=term, person=person, conversation=conversation)
+    rows = db.execute(
+        'SELECT month, SUM(count) FROM postings' + conditions + ' GROUP BY month ORDER BY month',
+        params).fetchall()
+    return [('{}-{:02d}'.format(month // 100, month % 100), count) for month, count in rows]
+
+
+def _filters(term=None, person=None, conversation=None):
+    conditions = []
+    params = []
+    if term is not None:
+        conditions.append('term_id = (SELECT id FROM terms WHERE term = ?)')
+        params.append(term.lower())
+    if person is not None:
+        conditions.append('person_id = (SELECT id FROM people WHERE name = ?)')
+        params.append(person)
+    if conversation is not None:
+        conditions.append('conversation_id = (SELECT id FROM conversations WHERE name = ?)')
+        params.append(conversation)
+    return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+
+if __name__ == '__main__':
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--person', help='only count the words this person sent')
+    common.add_argument('--conversation', help='only count the words of this conversation folder')
+    common.add_argument('-n', type=int, default=20, help='the number of results')
+    parser = argparse.ArgumentParser(
+        description='Queries the word index built by messenger_stats.py --index.')
+    subparsers = parser.add_subparsers(dest='query', required=True)
+    subparsers.add_parser('top', parents=[common], help='the most used words')
+    subparsers.add_parser('who', parents=[common],
+                          help='the people who used a word the most').add_argument('term')
+    subparsers.add_parser('trend', parents=[common],
+                          help='the use of a word per month').add_argument('term')
+    args = parser.parse_args()
+
+    if not os.path.isfile(INDEX_FILE):
+        print('Error: no word index found, run messenger_stats.py --index first')
+        exit()
+    db = connect()
+    if args.query == 'top':
+        rows = top_terms(db, args.person, args.conversation, args.n)
+    elif args.query == 'who':
+        rows = top_people(db, args.term, args.conversation, args.n)
+    else:
+        rows = term_over_time(db, args.term, args.person, args.conversation)
+    for row in rows:
+        print('\t'.join(str(value) for value in row))